@@ -0,0 +1,64 @@
+'''
+Compares the BeautifulSoup extraction used by async_fetch_and_parse with the
+lxml main-content extractor on the saved pages in benchmarks/fixtures.
+
+Usage: python -m benchmarks.extraction_benchmark [--rounds N]
+'''
+import argparse
+import glob
+import os
+import time
+
+from src.services.content_extractor import extract_main_content
+from src.services.extraction import extract_text_from_html
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+EXTRACTORS = {
+  "bs4 (html.parser)": extract_text_from_html,
+  "lxml main content": extract_main_content,
+}
+
+def load_fixtures() -> dict:
+  pages = {}
+  for path in sorted(glob.glob(os.path.join(FIXTURES, "*.html"))):
+    with open(path, encoding="utf-8") as file:
+      pages[os.path.basename(path)] = file.read()
+  return pages
+
+def benchmark(extractor, pages: dict, rounds: int) -> dict:
+  start = time.perf_counter()
+  for _ in range(rounds):
+    for html in pages.values():
+      extractor(html)
+  elapsed = time.perf_counter() - start
+
+  outputs = {name: extractor(html) or "" for name, html in pages.items()}
+  return {
+    "pages_per_second": len(pages) * rounds / elapsed,
+    "output_chars": {name: len(text) for name, text in outputs.items()},
+    "output_words": sum(len(text.split()) for text in outputs.values()),
+  }
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rounds", type=int, default=20)
+  args = parser.parse_args()
+
+  pages = load_fixtures()
+  input_chars = sum(len(html) for html in pages.values())
+  print(f"{len(pages)} pages, {input_chars} input characters, {args.rounds} rounds\n")
+
+  results = {name: benchmark(extractor, pages, args.rounds) for name, extractor in EXTRACTORS.items()}
+
+  print(f"{'extractor':<20} {'pages/s':>10} {'words out':>10}")
+  for name, result in results.items():
+    print(f"{name:<20} {result['pages_per_second']:>10.1f} {result['output_words']:>10}")
+
+  print("\nOutput characters per page:")
+  for page in pages:
+    sizes = "  ".join(f"{name}: {result['output_chars'][page]}" for name, result in results.items())
+    print(f"  {page:<26} {sizes}")
+
+if __name__ == "__main__":
+  main()
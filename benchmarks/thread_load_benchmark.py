@@ -0,0 +1,130 @@
+'''
+Compares loading a thread as full Search models (`Thread.get`) with the
+projected view used for follow-up searches (`Thread.get(lazy=True)`), for
+threads of growing length.
+
+The documents are synthetic but shaped like saved threads: ten sources per
+search with crawled content on the top five, ten images and a summary. The
+projection normally runs inside Mongo, so it is applied up front here and
+only deserialization and building the keyword context are timed. Payload
+sizes are the JSON size of what Mongo would send back.
+
+Usage: python -m benchmarks.thread_load_benchmark [--rounds N]
+'''
+import argparse
+import json
+import time
+import tracemalloc
+
+from src.models.search import CONTEXT_PLACES, CONTEXT_SOURCES, Thread
+
+THREAD_LENGTHS = [1, 5, 10, 25, 50]
+
+def make_source(i: int, crawled: bool) -> dict:
+  return {
+    "url": f"https://example.com/article/{i}",
+    "result_type": "web",
+    "title": f"Example article {i} about the query",
+    "hostname": "example.com",
+    "description": "A short description of the page. " * 3,
+    "snippet": "An extra snippet from the search engine. " * 6,
+    "favicon": "https://example.com/favicon.ico",
+    "crawled_content": ("Paragraph of crawled article text. " * 230) if crawled else None,
+    "thumbnail": "https://example.com/thumbnail.jpg",
+  }
+
+def make_search(thread_id: str, turn: int) -> dict:
+  return {
+    "thread_id": thread_id,
+    "query": f"follow-up question number {turn}",
+    "keywords": [f"keyword {turn}", f"another keyword {turn}"],
+    "search_type": "web",
+    "search_image": True,
+    "entity": None,
+    "featured_source": None,
+    "sources": [make_source(i, crawled=i < 5) for i in range(10)],
+    "images": [make_source(i, crawled=False) for i in range(10)],
+    "places": [],
+    "knowledge_panel": {"label": "Example", "description": "An example entity", "attributes": {}},
+    "summary": "A generated summary with citations [1]. " * 40,
+    "logs": {"keyword_generation_time": 0.8, "web_search_time": 0.6},
+    "follow_ups": ["What else?", "Why?", "How?"],
+    "search_mode": "basic",
+    "geolocation": None,
+    "location_used": None,
+    "warnings": [],
+  }
+
+def make_thread(length: int) -> dict:
+  return {
+    "_id": "abc123",
+    "id": "abc123",
+    "user_id": None,
+    "created_at": time.time(),
+    "updated_at": time.time(),
+    "version": length,
+    "searches": [make_search("abc123", turn) for turn in range(length)],
+  }
+
+def project(document: dict) -> dict:
+  '''
+  Python equivalent of `thread_view_pipeline`
+  '''
+  return {
+    "id": document["id"],
+    "user_id": document["user_id"],
+    "created_at": document["created_at"],
+    "updated_at": document["updated_at"],
+    "version": document["version"],
+    "context": [
+      {
+        "query": search["query"],
+        "search_type": search["search_type"],
+        "summary": search["summary"],
+        "sources": [{"title": source["title"], "snippet": source["snippet"]} for source in search["sources"][:CONTEXT_SOURCES]],
+        "places": search["places"][:CONTEXT_PLACES],
+        "knowledge_panel_label": (search["knowledge_panel"] or {}).get("label"),
+      }
+      for search in document["searches"]
+    ],
+  }
+
+def load_full(document: dict) -> str:
+  thread = Thread(**document)
+  return "".join(search.get_context() for search in thread.searches)
+
+def load_lazy(view: dict) -> str:
+  thread = Thread(**view, searches_loaded=False)
+  return "".join(context.get_context() for context in thread.history())
+
+def measure(loader, document: dict, rounds: int) -> dict:
+  start = time.perf_counter()
+  for _ in range(rounds):
+    context = loader(document)
+  elapsed = (time.perf_counter() - start) / rounds
+
+  tracemalloc.start()
+  loader(document)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return {"ms": elapsed * 1000, "peak_kb": peak / 1024, "payload_kb": len(json.dumps(document)) / 1024, "context": context}
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rounds", type=int, default=20)
+  args = parser.parse_args()
+
+  print(f"{'searches':>8} | {'full ms':>8} {'peak KB':>8} {'payload KB':>10} | {'lazy ms':>8} {'peak KB':>8} {'payload KB':>10}")
+  for length in THREAD_LENGTHS:
+    document = make_thread(length)
+    full = measure(load_full, document, args.rounds)
+    lazy = measure(load_lazy, project(document), args.rounds)
+    assert full["context"] == lazy["context"], "projected context differs from the full searches"
+    print(
+      f"{length:>8} | {full['ms']:>8.2f} {full['peak_kb']:>8.0f} {full['payload_kb']:>10.0f} |"
+      f" {lazy['ms']:>8.2f} {lazy['peak_kb']:>8.0f} {lazy['payload_kb']:>10.0f}"
+    )
+
+if __name__ == "__main__":
+  main()
@@ -4,32 +4,67 @@ from fastapi.responses import StreamingResponse
 from fastapi_utils.tasks import repeat_every
 
 from src.models.search import Thread
-from src.search import quest_search, summarise_article
+from src.search import coalesced_search, quest_search, summarise_article
+from src.components.config import SEARCH_COALESCING
 from src.services.news_crawler import begin_crawling_news
 from src.services.gnews.utils.constants import TOPICS as NEWS_TOPICS
 from src.routers.news import router as news_router
+from src.services import extraction, geoip, http_clients, indexes, llm, write_queue
+from src.components.knowledge import knowledge_panel_cache
+from src.components.build_search import keyword_cache
+from src.components.web_search import brave_cache
+from src.models.source import crawled_page_cache
 
 app = FastAPI()
 
 app.include_router(news_router, prefix="/news")
 
+@app.on_event("startup")
+async def startup():
+  await http_clients.startup()
+  await geoip.load_database()
+  await indexes.ensure_indexes()
+  await extraction.startup()
+
+@app.on_event("shutdown")
+async def shutdown():
+  # Queued writes go out first, before anything they might depend on is closed
+  await write_queue.shutdown()
+  await http_clients.shutdown()
+  await llm.shutdown()
+  await extraction.shutdown()
+
 @app.get("/")
 async def index():
   return "Welcome to Quest!"
+
+@app.get("/stats")
+async def stats():
+  return {
+    "llm": llm.stats(),
+    "upstreams": http_clients.stats(),
+    "knowledge_panel_cache": knowledge_panel_cache.stats(),
+    "keyword_cache": keyword_cache.stats(),
+    "brave_cache": brave_cache.stats(),
+    "crawled_page_cache": crawled_page_cache.stats(),
+    "extraction": extraction.stats(),
+    "write_queue": write_queue.stats()
+  }
     
 @app.get("/search")
 async def search_endpoint(
   request: Request,
   q: Optional[str] = None,
   thread_id: Optional[str] = None,
-  article_id: Optional[str] = None
+  article_id: Optional[str] = None,
+  protocol: int = 1
 ):
   assert q or article_id, "Please provide a query or article ID."
   
   if q:
     thread = None
     if thread_id:
-      thread = await Thread.get(thread_id)
+      thread = await Thread.get(thread_id, lazy=True)
     else:
       thread = Thread.create()
       
@@ -41,7 +76,10 @@ async def search_endpoint(
     
     client_ip = "130.212.93.147"
     
-    return StreamingResponse(quest_search(q, thread, client_ip), media_type="application/json")
+    if SEARCH_COALESCING and not thread_id:
+      return StreamingResponse(coalesced_search(q, client_ip, protocol), media_type="application/json")
+    
+    return StreamingResponse(quest_search(q, thread, client_ip, protocol), media_type="application/json")
   
   elif article_id:
     return StreamingResponse(summarise_article(article_id=article_id), media_type="application/json")
@@ -0,0 +1,109 @@
+'''
+Explains every query shape the app sends to Mongo and fails when one isn't
+served by an index.
+
+  python -m scripts.check_query_plans [--ensure]
+
+A query passes when its winning plan scans an index and no collection,
+and, for sorted queries, returns documents in index order without an
+in-memory SORT stage. With `--ensure` the declared indexes are created
+first, as they are on startup. Exits with status 1 when any query fails,
+so it can run after deploys or in CI against a real database.
+'''
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+import sys
+from typing import List, Optional, Set
+
+from src.models.search import thread_view_pipeline
+from src.services.database import mongo_client
+from src.services.indexes import ensure_indexes
+
+INDEX_STAGES = {"IXSCAN", "IDHACK", "EXPRESS_IXSCAN", "EXPRESS_IDHACK", "EXPRESS_CLUSTERED_IXSCAN", "COUNT_SCAN", "DISTINCT_SCAN"}
+
+@dataclass
+class QueryShape:
+  name: str
+  collection: str
+  filter: dict = field(default_factory=dict)
+  sort: Optional[dict] = None
+  limit: int = 0
+  pipeline: Optional[list] = None
+
+  def command(self) -> dict:
+    if self.pipeline is not None:
+      return {"aggregate": self.collection, "pipeline": self.pipeline, "cursor": {}}
+    command = {"find": self.collection, "filter": self.filter}
+    if self.sort:
+      command["sort"] = self.sort
+    if self.limit:
+      command["limit"] = self.limit
+    return command
+
+# Placeholder values only need the right types, plans don't depend on them
+QUERY_SHAPES: List[QueryShape] = [
+  QueryShape("Thread.get", "threads", {"id": "thread"}, limit=1),
+  QueryShape("Thread.get (lazy)", "threads", pipeline=thread_view_pipeline("thread")),
+  QueryShape("Thread.save (append)", "threads", {"id": "thread", "version": 1}, limit=1),
+  QueryShape("Article.get", "articles", {"id": "article"}, limit=1),
+  QueryShape("Article.gnews_exists", "articles", {"og_url": "https://news.google.com/"}, limit=1),
+  QueryShape("news feed", "articles", {"topic": "WORLD"}, sort={"publish_date": -1}, limit=10),
+  QueryShape("knowledge panel cache", "knowledge_panels", {"_id": "key"}, limit=1),
+  QueryShape("crawled page cache", "crawled_pages", {"_id": "key"}, limit=1),
+]
+
+def plan_stages(node, in_plan: bool = False) -> Set[str]:
+  '''
+  Stage names of every winning plan in an explain document, wherever the
+  server nests them (aggregation stages, sharded or SBE plans).
+  '''
+  stages = set()
+  if isinstance(node, dict):
+    if in_plan and isinstance(node.get("stage"), str):
+      stages.add(node["stage"])
+    for key, value in node.items():
+      if key == "rejectedPlans":
+        continue
+      stages |= plan_stages(value, in_plan or key == "winningPlan")
+  elif isinstance(node, list):
+    for value in node:
+      stages |= plan_stages(value, in_plan)
+  return stages
+
+def problems(shape: QueryShape, stages: Set[str]) -> List[str]:
+  found = []
+  if not stages:
+    found.append("no winning plan in the explain output")
+  if "COLLSCAN" in stages:
+    found.append("collection scan")
+  if stages and not stages & INDEX_STAGES:
+    found.append("no index scan")
+  if shape.sort and "SORT" in stages:
+    found.append("in-memory sort")
+  return found
+
+async def check(ensure: bool) -> bool:
+  if ensure:
+    await ensure_indexes()
+
+  ok = True
+  for shape in QUERY_SHAPES:
+    explain = await mongo_client.quest.command("explain", shape.command(), verbosity="queryPlanner")
+    stages = plan_stages(explain)
+    found = problems(shape, stages)
+    ok = ok and not found
+    status = "FAIL" if found else "ok"
+    detail = ", ".join(found) if found else ", ".join(sorted(stages))
+    print(f"{status:>4}  {shape.collection}: {shape.name} ({detail})")
+  return ok
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--ensure", action="store_true")
+  args = parser.parse_args()
+  if not asyncio.run(check(args.ensure)):
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,35 @@
+'''
+Adds the `version` and `updated_at` fields used by append-only thread saves
+to threads written before they existed.
+
+  python -m scripts.migrate_thread_versions [--dry-run]
+
+Running it is optional: unversioned threads are matched by their missing
+version and pick one up on their next save. Migrating up front keeps the
+collection uniform for indexes and queries on `version`.
+'''
+import argparse
+import asyncio
+
+from src.services.database import mongo_client
+
+async def migrate(dry_run: bool):
+  threads = mongo_client.quest.threads
+  query = {"version": {"$exists": False}}
+
+  pending = await threads.count_documents(query)
+  print(f"{pending} threads without a version")
+  if dry_run or pending == 0:
+    return
+
+  result = await threads.update_many(query, [{"$set": {"version": 0, "updated_at": "$created_at"}}])
+  print(f"Migrated {result.modified_count} threads")
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--dry-run", action="store_true")
+  args = parser.parse_args()
+  asyncio.run(migrate(args.dry_run))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,166 @@
+'''
+Offline training and evaluation of the local query classifier against the
+keyword model's logged completions.
+
+  python -m scripts.query_classifier export queries.jsonl [--limit N]
+  python -m scripts.query_classifier train queries.jsonl weights.json [--holdout 0.2]
+  python -m scripts.query_classifier evaluate queries.jsonl [--weights weights.json]
+
+`export` reads the first search of every thread (the only one built without
+context) whose keywords came from the model. `evaluate` reports, per
+threshold, how many queries would take the fast path and how often the fast
+path agrees with the model. Point QUERY_CLASSIFIER_WEIGHTS at the file
+written by `train` to use the trained weights.
+'''
+import argparse
+import asyncio
+import json
+import random
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from src.components.query_classifier import DEFAULT_WEIGHTS, QueryClassification, classify_query, load_weights, query_features
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+def parse_completion(raw: Optional[str]) -> Optional[dict]:
+  if not raw:
+    return None
+  try:
+    return json.loads(raw[raw.find("{"):raw.rfind("}") + 1])
+  except ValueError:
+    return None
+
+def token_set(text: str) -> set:
+  return set(text.lower().split())
+
+def keywords_agree(query_keywords: List[str], model_keywords: List[str]) -> bool:
+  '''
+  Keyword lists agree when their words overlap by at least half (Jaccard)
+  '''
+  ours = token_set(" ".join(query_keywords))
+  theirs = token_set(" ".join(model_keywords))
+  if not ours or not theirs:
+    return False
+  return len(ours & theirs) / len(ours | theirs) >= 0.5
+
+def agrees(classification: QueryClassification, completion: dict) -> bool:
+  return (
+    classification.search_type == completion.get("search_type", "web")
+    and not completion.get("entity")
+    and keywords_agree(classification.keywords, completion.get("keywords", []))
+  )
+
+def is_simple_web(query: str, completion: dict) -> bool:
+  '''
+  Training label: the model answered with a single keyword close to the query, as a web search without an entity
+  '''
+  keywords = completion.get("keywords", [])
+  return (
+    completion.get("search_type", "web") == "web"
+    and not completion.get("entity")
+    and len(keywords) == 1
+    and keywords_agree([query], keywords)
+  )
+
+def load_examples(path: str) -> List[Tuple[str, dict]]:
+  examples = []
+  with open(path) as file:
+    for line in file:
+      record = json.loads(line)
+      completion = parse_completion(record.get("completion"))
+      if record.get("query") and completion:
+        examples.append((record["query"], completion))
+  return examples
+
+async def export(path: str, limit: int):
+  from src.services.database import mongo_client
+
+  cursor = mongo_client.quest.threads.find({}, {"searches": {"$slice": 1}}).limit(limit)
+  count = 0
+  with open(path, "w") as file:
+    async for thread in cursor:
+      for search in thread.get("searches", [])[:1]:
+        raw_keywords = (search.get("logs") or {}).get("raw_keywords")
+        if raw_keywords:
+          file.write(json.dumps({"query": search["query"], "completion": raw_keywords}) + "\n")
+          count += 1
+  print(f"Exported {count} queries to {path}")
+
+def train(examples: List[Tuple[str, dict]], epochs: int = 500, learning_rate: float = 0.1, l2: float = 0.01) -> Dict[str, float]:
+  '''
+  Fits the linear model with batch gradient descent on the logistic loss
+  '''
+  names = list(DEFAULT_WEIGHTS)
+  features = np.array([[query_features(query).get(name, 0.0) for name in names] for query, _ in examples])
+  labels = np.array([float(is_simple_web(query, completion)) for query, completion in examples])
+
+  # Scale the word count so it trains at the same rate as the binary features
+  scale = np.maximum(features.max(axis=0), 1.0)
+  scaled = features / scale
+
+  weights = np.zeros(len(names))
+  for _ in range(epochs):
+    predictions = 1 / (1 + np.exp(-(scaled @ weights)))
+    gradient = scaled.T @ (predictions - labels) / len(labels) + l2 * weights
+    weights -= learning_rate * gradient
+
+  return {name: float(weight) for name, weight in zip(names, weights / scale)}
+
+def evaluate(examples: List[Tuple[str, dict]], weights: Dict[str, float]):
+  print(f"{len(examples)} queries, {sum(is_simple_web(q, c) for q, c in examples)} simple web searches according to the model\n")
+  print(f"{'threshold':>9} {'fast path':>10} {'agreement':>10} {'place rule':>11}")
+
+  for threshold in THRESHOLDS:
+    taken = agreed = place_taken = place_agreed = 0
+    for query, completion in examples:
+      classification = classify_query(query, threshold=threshold, weights=weights)
+      if classification is None:
+        continue
+      taken += 1
+      agreed += agrees(classification, completion)
+      if classification.search_type == "place":
+        place_taken += 1
+        place_agreed += agrees(classification, completion)
+
+    coverage = taken / len(examples) if examples else 0
+    agreement = agreed / taken if taken else 0
+    place = f"{place_agreed}/{place_taken}"
+    print(f"{threshold:>9.2f} {coverage:>10.1%} {agreement:>10.1%} {place:>11}")
+
+def main():
+  parser = argparse.ArgumentParser()
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  export_parser = commands.add_parser("export")
+  export_parser.add_argument("output")
+  export_parser.add_argument("--limit", type=int, default=50000)
+
+  train_parser = commands.add_parser("train")
+  train_parser.add_argument("data")
+  train_parser.add_argument("output")
+  train_parser.add_argument("--holdout", type=float, default=0.2)
+
+  evaluate_parser = commands.add_parser("evaluate")
+  evaluate_parser.add_argument("data")
+  evaluate_parser.add_argument("--weights")
+
+  args = parser.parse_args()
+
+  if args.command == "export":
+    asyncio.run(export(args.output, args.limit))
+  elif args.command == "train":
+    examples = load_examples(args.data)
+    random.Random(0).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout))
+    weights = train(examples[:split])
+    with open(args.output, "w") as file:
+      json.dump(weights, file, indent=2)
+    print(f"Trained on {split} queries, wrote weights to {args.output}\n")
+    print("Held-out evaluation:")
+    evaluate(examples[split:], weights)
+  elif args.command == "evaluate":
+    evaluate(load_examples(args.data), load_weights(args.weights))
+
+if __name__ == "__main__":
+  main()
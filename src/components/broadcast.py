@@ -0,0 +1,50 @@
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+class StreamBroadcast:
+  '''
+  Runs an async generator once in the background and lets any number of
+  subscribers replay its output from the start, including events that were
+  produced before they subscribed.
+  '''
+  def __init__(self, source: AsyncIterator[str]):
+    self.events: List[str] = []
+    self.finished = False
+    self.error: Optional[BaseException] = None
+    self.subscribers = 0
+    self._condition = asyncio.Condition()
+    self.task = asyncio.create_task(self._pump(source))
+
+  async def _pump(self, source: AsyncIterator[str]):
+    try:
+      async for event in source:
+        async with self._condition:
+          self.events.append(event)
+          self._condition.notify_all()
+    except Exception as e:
+      self.error = e
+    finally:
+      async with self._condition:
+        self.finished = True
+        self._condition.notify_all()
+
+  async def wait(self):
+    await asyncio.shield(self.task)
+
+  async def subscribe(self) -> AsyncIterator[str]:
+    self.subscribers += 1
+    index = 0
+    while True:
+      async with self._condition:
+        await self._condition.wait_for(lambda: index < len(self.events) or self.finished)
+        pending = self.events[index:]
+        finished = self.finished
+
+      for event in pending:
+        yield event
+      index += len(pending)
+
+      if finished and index >= len(self.events):
+        if self.error:
+          raise self.error
+        return
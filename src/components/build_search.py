@@ -1,29 +1,56 @@
 import json
 
-from openai import AsyncOpenAI
-
 from src.models.article import Article
 from .prompts import SEARCH_BUILDER_MESSAGES
 from ..models.search import Search, Thread
-from .keys import GROQ_API_KEY, OPENAI_API_KEY
+from ..services import llm
+from .cache import MISSING, TTLCache
+from .config import KEYWORD_CACHE_SIZE, KEYWORD_CACHE_TTL, KEYWORD_GENERATION_DEADLINE, QUERY_FAST_PATH
+from .query_classifier import classify_query
 
-from groq import AsyncGroq
 from typing import Optional
 import time
 import os
 
-async def build_search(query: str, thread: Thread, attempt: int = 1) -> Optional[Search]:
-  try:
-    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+keyword_cache = TTLCache(max_size=KEYWORD_CACHE_SIZE, ttl=KEYWORD_CACHE_TTL)
+
+def normalize_query(query: str) -> str:
+  return " ".join(query.casefold().split()).rstrip("?!. ")
+
+# Models used for each provider, in order of preference
+KEYWORD_MODELS = {
+  "openai": "gpt-3.5-turbo-0125",
+  "groq": "mixtral-8x7b-32768",
+}
+
+async def build_search(query: str, thread: Thread) -> Optional[Search]:
+  # Keywords only depend on the query when there is no thread context to take into account
+  cache_key = normalize_query(query) if thread.turn_count == 0 and KEYWORD_CACHE_TTL > 0 else None
+
+  if cache_key:
+    cached = keyword_cache.get(cache_key)
+    if cached is not MISSING:
+      data, raw_keywords = cached
+      search = Search.create(query, thread.id, data)
+      search.logs.raw_keywords = raw_keywords
+      search.logs.cache_hits += 1
+      return search
+
+  # Simple context-free queries are classified locally instead of waiting on the keyword model
+  if QUERY_FAST_PATH and thread.turn_count == 0:
+    classification = classify_query(query)
+    if classification:
+      search = Search.create(query, thread.id, classification.to_json())
+      search.logs.classifier_confidence = classification.confidence
+      return search
 
+  try:
     messages = []
 
     context = ""
 
-    if len(thread.searches) >= 1:
-      context = "Context from previous searches:\n"
-      for search in thread.searches:
-        context += search.get_context() + "\n"
+    if thread.turn_count >= 1:
+      context = "Context from previous searches:\n" + thread.context_digest().text()
         
     if context != "":
       print('Found context:')
@@ -44,45 +71,48 @@ async def build_search(query: str, thread: Thread, attempt: int = 1) -> Optional
 
     start_time = time.time()
 
-    chat_completion = await client.chat.completions.create(
-      messages=messages,
-      model="gpt-3.5-turbo-0125",
-      stop=["</s>", "[/INST]"],
-      temperature=0.2,
-      response_format={"type": "json_object"},
-    )
+    async def generate(client, model: str):
+      chat_completion = await client.chat.completions.create(
+        messages=messages,
+        model=model,
+        stop=["</s>", "[/INST]"],
+        temperature=0.2,
+        response_format={"type": "json_object"},
+      )
+
+      info = chat_completion.choices[0].message.content
+
+      print(f"Search: {info}")
 
-    info = chat_completion.choices[0].message.content
-    
-    print(f"Search: {info}")
+      first_p = info.find("{")
+      last_p = info.rfind("}") + 1
 
-    first_p = info.find("{")
-    last_p = info.rfind("}") + 1
+      # Parsed inside the call so malformed output is retried too
+      return info, info[first_p:last_p], Search.create(query, thread.id, info[first_p:last_p])
 
-    search = Search.create(query, thread.id, info[first_p:last_p])
+    info, data, search = await llm.call_with_policy(generate, KEYWORD_MODELS, deadline=KEYWORD_GENERATION_DEADLINE)
 
     search.logs.raw_keywords = info
     search.logs.keyword_generation_time = time.time() - start_time
 
+    if cache_key:
+      keyword_cache.set(cache_key, (data, info))
+      search.logs.cache_misses += 1
+
     return search
 
   except Exception as e:
     print(f"Exception {e}")
-    if attempt < 5:
-      return await build_search(query, thread, attempt + 1)
-    else:
-      print('Falling back to basic search')
-      return Search.create(query, json.dumps({
-        "keywords": [query],
-        "search_type": "web",
-        "search_image": True,
-        "entity": None
-      }))
+    print('Falling back to basic search')
+    return Search.create(query, thread.id, json.dumps({
+      "keywords": [query],
+      "search_type": "web",
+      "search_image": True,
+      "entity": None
+    }))
       
-async def rewrite_headline(article: Article, attempt: int = 1) -> str:
+async def rewrite_headline(article: Article) -> str:
   try:
-    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-    
     REWRITE_HEADLINE_PROMPT = """
 You are a neutral news writer. You have been given the following article and asked to rewrite it in a more neutral tone that is suitable for a general audience. You should not include any opinions or biases in your rewrite. The headline should be concise and informative.
 
@@ -112,25 +142,25 @@ OpenAI has recently unveiled a new voice cloning technology called "Voice Engine
       }
     ]
 
-    chat_completion = await client.chat.completions.create(
-      messages=messages,
-      model="gpt-3.5-turbo-0125",
-      temperature=0.2,
-      response_format={"type": "json_object"},
-    )
-    
-    response = chat_completion.choices[0].message.content
+    async def rewrite(client, model: str) -> str:
+      chat_completion = await client.chat.completions.create(
+        messages=messages,
+        model=model,
+        temperature=0.2,
+        response_format={"type": "json_object"},
+      )
+      
+      response = chat_completion.choices[0].message.content
+
+      first_p = response.find("{")
+      last_p = response.rfind("}") + 1
 
-    first_p = response.find("{")
-    last_p = response.rfind("}") + 1
+      rewritten_headline = response[first_p:last_p]
 
-    rewritten_headline = response[first_p:last_p]
+      return json.loads(rewritten_headline)["headline"]
 
-    return json.loads(rewritten_headline)["headline"]
+    return await llm.call_with_policy(rewrite, KEYWORD_MODELS)
   except Exception as e:
     print(f"Exception {e}")
-    if attempt < 5:
-      return await rewrite_headline(article, attempt + 1)
-    else:
-      print('Falling back to basic search')
-      return article.title
\ No newline at end of file
+    print('Falling back to basic search')
+    return article.title
\ No newline at end of file
@@ -0,0 +1,102 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import time
+
+MISSING = object()
+
+class CacheEntry:
+  __slots__ = ("value", "stored_at", "expires_at")
+
+  def __init__(self, value: Any, stored_at: float, expires_at: float):
+    self.value = value
+    self.stored_at = stored_at
+    self.expires_at = expires_at
+
+  @property
+  def age(self) -> float:
+    return time.monotonic() - self.stored_at
+
+  def is_expired(self, now: Optional[float] = None) -> bool:
+    return (now or time.monotonic()) >= self.expires_at
+
+class TTLCache:
+  '''
+  In-process LRU cache where every entry also expires after a TTL.
+
+  `None` is a valid cached value (useful for negative caching), so lookups
+  return `MISSING` by default when nothing usable is stored.
+  '''
+  def __init__(self, max_size: int, ttl: float):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def get(self, key: Hashable, default: Any = MISSING) -> Any:
+    entry = self._entries.get(key)
+    if entry is None or entry.is_expired():
+      if entry is not None:
+        del self._entries[key]
+      self.misses += 1
+      return default
+    self._entries.move_to_end(key)
+    self.hits += 1
+    return entry.value
+
+  def get_entry(self, key: Hashable) -> Optional[CacheEntry]:
+    '''
+    Returns the raw entry even when it has expired, so callers can serve
+    stale values while they refresh them.
+    '''
+    entry = self._entries.get(key)
+    if entry is not None:
+      self._entries.move_to_end(key)
+    return entry
+
+  def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+    now = time.monotonic()
+    self._entries[key] = CacheEntry(value, now, now + (self.ttl if ttl is None else ttl))
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  def delete(self, key: Hashable):
+    self._entries.pop(key, None)
+
+  def clear(self):
+    self._entries.clear()
+
+  def stats(self) -> dict:
+    return {
+      "size": len(self._entries),
+      "max_size": self.max_size,
+      "hits": self.hits,
+      "misses": self.misses,
+    }
+
+class SingleFlight:
+  '''
+  Coalesces concurrent calls that share a key into a single execution.
+
+  The first caller starts the work as a task; everyone else awaits the same
+  task. The task is shielded so a cancelled caller doesn't cancel the work
+  for the others.
+  '''
+  def __init__(self):
+    self._calls: Dict[Hashable, asyncio.Task] = {}
+
+  def __len__(self) -> int:
+    return len(self._calls)
+
+  async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+    task = self._calls.get(key)
+    if task is None:
+      task = asyncio.ensure_future(fn())
+      self._calls[key] = task
+      task.add_done_callback(lambda _: self._calls.pop(key, None))
+    return await asyncio.shield(task)
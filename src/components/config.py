@@ -0,0 +1,112 @@
+import os
+
+# LLM providers
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "64"))
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "32"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "15"))  # Overall budget for a call including retries
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+LLM_ACQUIRE_TIMEOUT = float(os.getenv("LLM_ACQUIRE_TIMEOUT", "1.0"))  # Wait for a provider slot before failing over
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.2"))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "2.0"))
+LLM_HEALTH_WINDOW = int(os.getenv("LLM_HEALTH_WINDOW", "50"))
+LLM_HEALTH_MIN_SAMPLES = int(os.getenv("LLM_HEALTH_MIN_SAMPLES", "10"))
+LLM_FAILOVER_ERROR_RATE = float(os.getenv("LLM_FAILOVER_ERROR_RATE", "0.3"))
+LLM_FAILOVER_LATENCY = float(os.getenv("LLM_FAILOVER_LATENCY", "4.0"))  # Rolling p95 in seconds
+
+# Geolocation
+GEOIP_DATABASE_PATH = os.getenv("GEOIP_DATABASE_PATH")
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "50000"))
+GEOIP_CACHE_TTL = float(os.getenv("GEOIP_CACHE_TTL", str(60 * 60 * 6)))
+GEOIP_NEGATIVE_CACHE_TTL = float(os.getenv("GEOIP_NEGATIVE_CACHE_TTL", "60"))
+
+# Knowledge panels
+KNOWLEDGE_CACHE_SIZE = int(os.getenv("KNOWLEDGE_CACHE_SIZE", "5000"))
+KNOWLEDGE_CACHE_FRESH_FOR = float(os.getenv("KNOWLEDGE_CACHE_FRESH_FOR", str(60 * 60 * 24)))
+KNOWLEDGE_NEGATIVE_CACHE_FRESH_FOR = float(os.getenv("KNOWLEDGE_NEGATIVE_CACHE_FRESH_FOR", str(60 * 60)))
+KNOWLEDGE_CACHE_MAX_AGE = float(os.getenv("KNOWLEDGE_CACHE_MAX_AGE", str(60 * 60 * 24 * 7)))
+
+# Keyword generation
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "20000"))
+KEYWORD_CACHE_TTL = float(os.getenv("KEYWORD_CACHE_TTL", str(60 * 30)))
+# Keyword generation blocks the whole pipeline, so it gets a tighter budget than other LLM calls
+KEYWORD_GENERATION_DEADLINE = float(os.getenv("KEYWORD_GENERATION_DEADLINE", "6"))
+# Local classifier that lets simple queries skip the keyword model. Off until
+# `scripts/query_classifier.py evaluate` shows trained weights agree with the model
+QUERY_FAST_PATH = os.getenv("QUERY_FAST_PATH", "false").lower() in ("1", "true", "yes")
+QUERY_CLASSIFIER_THRESHOLD = float(os.getenv("QUERY_CLASSIFIER_THRESHOLD", "0.85"))
+QUERY_CLASSIFIER_WEIGHTS = os.getenv("QUERY_CLASSIFIER_WEIGHTS")  # JSON weights written by scripts/query_classifier.py
+
+# Brave search results
+BRAVE_CACHE_SIZE = int(os.getenv("BRAVE_CACHE_SIZE", "5000"))  # entries hold trimmed sources, ~20-40KB each
+BRAVE_CACHE_TTLS = {
+  "web": float(os.getenv("BRAVE_WEB_CACHE_TTL", str(60 * 60))),
+  "news": float(os.getenv("BRAVE_NEWS_CACHE_TTL", "120")),
+  "images": float(os.getenv("BRAVE_IMAGES_CACHE_TTL", str(60 * 60 * 6))),
+}
+WEB_SEARCH_MAX_SOURCES = int(os.getenv("WEB_SEARCH_MAX_SOURCES", "12"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Search pipeline
+SEARCH_COALESCING = os.getenv("SEARCH_COALESCING", "false").lower() in ("1", "true", "yes")
+# Latency budget per quest_search stage, in seconds. A stage that runs out of
+# budget is dropped from the response instead of holding it up.
+STAGE_DEADLINES = {
+  "geolocation": float(os.getenv("STAGE_DEADLINE_GEOLOCATION", "1.0")),
+  "speculative_web": float(os.getenv("STAGE_DEADLINE_SPECULATIVE_WEB", "3.0")),
+  "speculative_images": float(os.getenv("STAGE_DEADLINE_SPECULATIVE_IMAGES", "2.0")),
+  "results": float(os.getenv("STAGE_DEADLINE_RESULTS", "4.0")),
+  "images": float(os.getenv("STAGE_DEADLINE_IMAGES", "1.5")),
+  "knowledge": float(os.getenv("STAGE_DEADLINE_KNOWLEDGE", "1.5")),
+}
+
+# Hedged upstream requests
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# Upstream resilience
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "10"))
+LIMIT_BACKOFF = float(os.getenv("LIMIT_BACKOFF", "0.9"))  # Applied at most once per window
+LIMIT_MIN_WINDOW = float(os.getenv("LIMIT_MIN_WINDOW", "1.0"))  # Windows last an upstream's latency target, at least this
+LIMIT_CONGESTED_SHARE = float(os.getenv("LIMIT_CONGESTED_SHARE", "0.5"))  # Slow or failed share of a window that shrinks the limit
+LIMIT_MAX_QUEUE = int(os.getenv("LIMIT_MAX_QUEUE", "100"))
+LIMIT_QUEUE_TIMEOUT = float(os.getenv("LIMIT_QUEUE_TIMEOUT", "0.25"))
+
+# Thread persistence
+THREAD_APPEND_ONLY = os.getenv("THREAD_APPEND_ONLY", "true").lower() in ("1", "true", "yes")
+THREAD_SAVE_ATTEMPTS = int(os.getenv("THREAD_SAVE_ATTEMPTS", "3"))
+
+# Write-behind persistence
+WRITE_QUEUE_MAX_PENDING = int(os.getenv("WRITE_QUEUE_MAX_PENDING", "5000"))
+WRITE_QUEUE_BATCH_SIZE = int(os.getenv("WRITE_QUEUE_BATCH_SIZE", "100"))
+WRITE_QUEUE_FLUSH_INTERVAL = float(os.getenv("WRITE_QUEUE_FLUSH_INTERVAL", "0.25"))
+WRITE_QUEUE_MAX_RETRIES = int(os.getenv("WRITE_QUEUE_MAX_RETRIES", "3"))
+WRITE_QUEUE_DRAIN_TIMEOUT = float(os.getenv("WRITE_QUEUE_DRAIN_TIMEOUT", "10"))
+
+# Thread context for keyword generation
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "3"))
+CONTEXT_DIGEST_TOKENS = int(os.getenv("CONTEXT_DIGEST_TOKENS", "1500"))
+
+# HTML extraction
+EXTRACTION_EXECUTOR = os.getenv("EXTRACTION_EXECUTOR", "process")  # "process" or "thread"
+EXTRACTION_PARSER = os.getenv("EXTRACTION_PARSER", "lxml")  # "lxml" or "bs4"
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(max(2, (os.cpu_count() or 2) - 1))))
+EXTRACTION_MAX_QUEUE = int(os.getenv("EXTRACTION_MAX_QUEUE", "64"))
+EXTRACTION_CPU_TIME_LIMIT = float(os.getenv("EXTRACTION_CPU_TIME_LIMIT", "0.5"))
+
+# Source crawling
+CRAWL_MAX_BYTES = int(os.getenv("CRAWL_MAX_BYTES", str(1024 * 1024)))
+CRAWL_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+CRAWL_DEADLINE = float(os.getenv("CRAWL_DEADLINE", "3.0"))  # Seconds after the search started by which summarising begins
+CRAWL_BUDGET = float(os.getenv("CRAWL_BUDGET", "1.5"))  # Time a full fan-out crawl is allowed to take
+CRAWL_MIN_TIME = float(os.getenv("CRAWL_MIN_TIME", "0.3"))
+CRAWL_MAX_SOURCES = int(os.getenv("CRAWL_MAX_SOURCES", "5"))
+CRAWL_MAX_CHARS = int(os.getenv("CRAWL_MAX_CHARS", "8000"))
+CRAWL_CACHE_SIZE = int(os.getenv("CRAWL_CACHE_SIZE", "1000"))
+CRAWL_CACHE_FRESH_FOR = float(os.getenv("CRAWL_CACHE_FRESH_FOR", str(60 * 60)))
+CRAWL_CACHE_MAX_AGE = float(os.getenv("CRAWL_CACHE_MAX_AGE", str(60 * 60 * 24 * 7)))
+
+# Summaries
+SUMMARY_CONTEXT_TOKENS = int(os.getenv("SUMMARY_CONTEXT_TOKENS", "3000"))
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from typing import Optional
+
+from ..models.search import Search
+from .config import CRAWL_BUDGET, CRAWL_DEADLINE, CRAWL_MAX_CHARS, CRAWL_MAX_SOURCES, CRAWL_MIN_TIME
+
+def crawl_fan_out(remaining: float) -> int:
+  '''
+  Number of sources worth crawling with the given time left. The full fan-out
+  is used when the whole budget is available and it shrinks linearly as the
+  earlier stages eat into it.
+  '''
+  if remaining < CRAWL_MIN_TIME:
+    return 0
+  return max(1, min(CRAWL_MAX_SOURCES, round(CRAWL_MAX_SOURCES * remaining / CRAWL_BUDGET)))
+
+async def crawl_sources(search: Search, deadline: Optional[float] = None):
+  '''
+  Crawls the top sources of a search concurrently until the deadline.
+
+  Whatever content has arrived when the deadline hits is kept, the remaining
+  crawls are cancelled and the other sources fall back to their snippets.
+
+  :param search: The search whose sources should be crawled
+  :param deadline: `time.time()` by which summarising has to start, defaults to CRAWL_DEADLINE from now
+  '''
+  start_time = time.time()
+  deadline = min(deadline or start_time + CRAWL_DEADLINE, start_time + CRAWL_BUDGET)
+  remaining = deadline - start_time
+
+  candidates = [source for source in search.sources if source.result_type in ("web", "news") and not source.crawled_content]
+  candidates = candidates[:crawl_fan_out(remaining)]
+
+  search.logs.crawl_attempted = len(candidates)
+
+  if not candidates:
+    return
+
+  async def crawl_source(source):
+    content = await source.crawl()
+    if content:
+      source.crawled_content = content[:CRAWL_MAX_CHARS]
+    return content
+
+  tasks = [asyncio.create_task(crawl_source(source)) for source in candidates]
+  done, pending = await asyncio.wait(tasks, timeout=max(0, deadline - time.time()))
+
+  for task in pending:
+    task.cancel()
+
+  search.logs.crawled_sources = sum(1 for task in done if not task.cancelled() and task.exception() is None and task.result())
+  search.logs.crawl_time = time.time() - start_time
@@ -0,0 +1,24 @@
+import json
+from typing import Any, Optional
+
+# Version of the progressive /search protocol. Version 1 is the original
+# response: one JSON blob with every part, followed by summary deltas and
+# the follow-ups.
+PROTOCOL_VERSION = 2
+
+# Events of the progressive protocol, in the order they usually arrive.
+# `sources`, `places`, `images` and `knowledge_panel` are sent as soon as
+# their own stage finishes, so their relative order varies. The summary
+# and follow-ups only wait for the sources, so `delta` and `follow_ups`
+# events can arrive before the images or the knowledge panel.
+EVENTS = ("search", "sources", "places", "images", "knowledge_panel", "delta", "follow_ups", "done")
+
+def encode_event(event: str, data: Optional[Any] = None) -> str:
+  '''
+  Serializes an event as one NDJSON line
+  '''
+  return json.dumps({
+    "event": event,
+    "version": PROTOCOL_VERSION,
+    "data": data if data is not None else {}
+  }) + "\n"
@@ -1,9 +1,8 @@
 import ast
 from ..models.search import Search
-from groq import AsyncGroq
+from ..services import llm
 from typing import Optional
 from .prompts import FOLLOW_UP_PROMPT
-from .keys import GROQ_API_KEY
 
 def parse_list_from_string(list_string: str):
   try:
@@ -32,16 +31,13 @@ async def generate_follow_ups(search: Search):
     },
   ]
 
-  groq_client = AsyncGroq(
-    api_key=GROQ_API_KEY
-  )
-
-  chat_completion = await groq_client.chat.completions.create(
-    messages=messages,
-    model="mixtral-8x7b-32768",
-    top_p=1,
-    temperature=0.1
-  )
+  async with llm.acquire("groq") as groq_client:
+    chat_completion = await groq_client.chat.completions.create(
+      messages=messages,
+      model="mixtral-8x7b-32768",
+      top_p=1,
+      temperature=0.1
+    )
 
   try:
     search.follow_ups = parse_list_from_string(chat_completion.choices[0].message.content)
@@ -2,7 +2,7 @@ from datetime import datetime, timezone
 import random
 import string
 from typing import Optional
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse, urlunparse
 
 def clean_graph(input_dict: dict) -> dict:
   """
@@ -79,4 +79,39 @@ def extract_gnews_article_id(url):
   '''
   Find and returns the article ID from given Google News URL
   '''
-  return url.split('/articles/')[1].split('?')[0]
\ No newline at end of file
+  return url.split('/articles/')[1].split('?')[0]
+
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src", "_ga", "_hsenc", "_hsmi"}
+
+def canonicalize_url(url: str) -> str:
+  '''
+  Normalizes a URL so that links to the same page compare equal. Drops the
+  fragment, tracking parameters and a leading `www.`, lowercases the scheme
+  and host, and sorts the remaining query parameters.
+  '''
+  try:
+    parsed = urlparse(url.strip())
+    port = parsed.port  # Raises for a malformed port, e.g. "example.com:abc"
+  except ValueError:
+    return url
+
+  hostname = (parsed.hostname or "").lower()
+  if hostname.startswith("www."):
+    hostname = hostname[4:]
+  if ":" in hostname:
+    # urlparse strips the brackets around IPv6 addresses
+    hostname = f"[{hostname}]"
+  netloc = hostname
+  if port and not ((parsed.scheme == "http" and port == 80) or (parsed.scheme == "https" and port == 443)):
+    netloc = f"{hostname}:{port}"
+
+  query = [
+    (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+    if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+  ]
+
+  path = parsed.path or "/"
+  if len(path) > 1 and path.endswith("/"):
+    path = path.rstrip("/")
+
+  return urlunparse((parsed.scheme.lower(), netloc, path, parsed.params, urlencode(sorted(query)), ""))
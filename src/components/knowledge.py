@@ -1,16 +1,24 @@
 from typing import Optional, Dict, Any
+import asyncio
 import httpx
 import time
 
 from .helpers import clean_graph, fix_graph_links
+from .config import KNOWLEDGE_CACHE_SIZE, KNOWLEDGE_CACHE_FRESH_FOR, KNOWLEDGE_CACHE_MAX_AGE, KNOWLEDGE_NEGATIVE_CACHE_FRESH_FOR
+from ..services.http_clients import hedged_get, is_available
+from ..services.tiered_cache import TieredCache
 
-async def search_entity(entity: str, language: str = "en") -> Optional[Dict[str, Any]]:
+knowledge_panel_cache = TieredCache("knowledge_panels", max_size=KNOWLEDGE_CACHE_SIZE, max_age=KNOWLEDGE_CACHE_MAX_AGE)
+_refreshing: Dict[str, asyncio.Task] = {}
+
+async def search_entity(entity: str, language: str = "en", raise_errors: bool = False) -> Optional[Dict[str, Any]]:
   """
   Asynchronously search for a Wikidata entity by query and return its first matching result.
 
   Parameters:
   entity (str): The search query to find the entity on Wikidata.
   language (str, optional): The language in which to perform the search. Defaults to "en".
+  raise_errors (bool, optional): Re-raise HTTP errors instead of returning None. Defaults to False.
 
   Returns:
   Optional[Dict[str, Any]]: The first matching entity as a dictionary, or None if no match is found.
@@ -23,8 +31,7 @@ async def search_entity(entity: str, language: str = "en") -> Optional[Dict[str,
     "search": entity
   }
   try:
-    async with httpx.AsyncClient() as client:
-      response = await client.get(wikidata_search_url, params=params)
+    response = await hedged_get("wikidata", wikidata_search_url, params=params)
     response.raise_for_status()  # Raises HTTPError for bad responses
 
     # Parse the JSON response
@@ -37,12 +44,16 @@ async def search_entity(entity: str, language: str = "en") -> Optional[Dict[str,
       return None
   except httpx.HTTPStatusError as http_err:
     print(f"HTTP error occurred: {http_err}")
+    if raise_errors:
+      raise
     return None
   except httpx.RequestError as err:
     print(f"Request exception: {err}")
+    if raise_errors:
+      raise
     return None
 
-async def get_knowledge_graph(q_number: str, language: str = "en") -> Optional[Dict]:
+async def get_knowledge_graph(q_number: str, language: str = "en", raise_errors: bool = False) -> Optional[Dict]:
   try:
     # Configure the SPARQL query
     endpoint = "https://query.wikidata.org/sparql"
@@ -59,8 +70,7 @@ async def get_knowledge_graph(q_number: str, language: str = "en") -> Optional[D
     }
 
     # Asynchronously fetch data from the SPARQL endpoint
-    async with httpx.AsyncClient() as client:
-      response = await client.get(endpoint, params=params)
+    response = await hedged_get("wikidata_sparql", endpoint, params=params)
     response.raise_for_status()  # Raises exception for bad responses
 
     results = response.json()
@@ -140,21 +150,26 @@ async def get_knowledge_graph(q_number: str, language: str = "en") -> Optional[D
     graph['attributes'] = clean_graph(attributes)
 
     return graph
+  except httpx.HTTPError as e:
+    print(f"Problem encountered: {e}")
+    if raise_errors:
+      raise
+    return None
   except Exception as e:
     print(f"Problem encountered: {e}")
     return None
 
-async def generate_knowledge_panel(query: str, language: str = "en"):
-  """
-  Generates a Knowledge Panel/Graph for the given entity (query)
+def normalize_entity(entity: str) -> str:
+  return " ".join(entity.casefold().split())
 
-  Parameters:
-  query (str): The search query to find the entity on Wikidata.
+async def build_knowledge_panel(query: str, language: str = "en") -> Optional[dict]:
+  """
+  Builds a Knowledge Panel straight from Wikidata, bypassing the cache.
 
-  Returns:
-  dict: A dictionary of knowledge graph with image, label, description and attributes
+  Returns None when the entity does not resolve and raises on HTTP errors so
+  that outages are not cached as missing entities.
   """
-  entity = await search_entity(query, language)
+  entity = await search_entity(query, language, raise_errors=True)
 
   if not entity:
     return None
@@ -163,7 +178,7 @@ async def generate_knowledge_panel(query: str, language: str = "en"):
   label = entity['display']['label']['value']
   description = entity['display']['description']['value']
 
-  graph = await get_knowledge_graph(q_number, language)
+  graph = await get_knowledge_graph(q_number, language, raise_errors=True)
 
   if not graph:
     return None
@@ -173,6 +188,48 @@ async def generate_knowledge_panel(query: str, language: str = "en"):
 
   return graph
 
+async def refresh_knowledge_panel(key: str, query: str, language: str = "en") -> Optional[dict]:
+  try:
+    panel = await build_knowledge_panel(query, language)
+  except Exception as e:
+    print(f"Error building knowledge panel for {query}: {e}")
+    return None
+
+  fresh_for = KNOWLEDGE_CACHE_FRESH_FOR if panel else KNOWLEDGE_NEGATIVE_CACHE_FRESH_FOR
+  knowledge_panel_cache.set(key, panel, fresh_for=fresh_for, meta={"entity": query, "language": language})
+  return panel
+
+async def generate_knowledge_panel(query: str, language: str = "en"):
+  """
+  Generates a Knowledge Panel/Graph for the given entity (query)
+
+  Panels are cached by normalized entity name and language. Entities that
+  don't resolve are cached too, and stale entries are served while a
+  background refresh runs. Uncached panels are skipped while a Wikidata
+  circuit breaker is open.
+
+  Parameters:
+  query (str): The search query to find the entity on Wikidata.
+
+  Returns:
+  dict: A dictionary of knowledge graph with image, label, description and attributes
+  """
+  key = f"{language}:{normalize_entity(query)}"
+
+  cached = await knowledge_panel_cache.get(key)
+  if cached is not None:
+    if not cached.is_fresh and key not in _refreshing:
+      task = asyncio.create_task(refresh_knowledge_panel(key, query, language))
+      _refreshing[key] = task
+      task.add_done_callback(lambda _: _refreshing.pop(key, None))
+    return dict(cached.value) if cached.value else None
+
+  # Skip the panel instead of waiting on Wikidata while it is failing
+  if not is_available("wikidata") or not is_available("wikidata_sparql"):
+    return None
+
+  return await refresh_knowledge_panel(key, query, language)
+
 if __name__ == "__main__":
   import asyncio
   query = "OpenAI"
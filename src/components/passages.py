@@ -0,0 +1,123 @@
+import re
+from typing import List, Optional, Tuple
+import numpy as np
+
+from ..models.source import Source
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+STOP_WORDS = {
+  "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+  "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which",
+  "who", "why", "will", "with", "does", "do", "about", "me", "my", "i", "you",
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Small boost for sources the search engine ranked higher, used to break ties
+RANK_PRIOR = 0.15
+
+def tokenize(text: str) -> List[str]:
+  return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+def estimate_tokens(text: str) -> int:
+  '''
+  Rough token count for English text, close enough for budgeting prompts
+  '''
+  return max(1, len(text) // 4)
+
+def split_passages(text: str, max_words: int = 120) -> List[str]:
+  '''
+  Splits text into passages of at most `max_words` words. Paragraph breaks are
+  respected and short consecutive paragraphs are merged.
+  '''
+  passages = []
+  current: List[str] = []
+
+  for paragraph in re.split(r"\n\s*\n", text):
+    words = paragraph.split()
+    while words:
+      room = max_words - len(current)
+      if room <= 0:
+        passages.append(" ".join(current))
+        current = []
+        room = max_words
+      current.extend(words[:room])
+      words = words[room:]
+    if len(current) >= max_words // 2:
+      passages.append(" ".join(current))
+      current = []
+
+  if current:
+    passages.append(" ".join(current))
+
+  return passages
+
+def bm25_scores(passages: List[str], query_terms: List[str]) -> np.ndarray:
+  '''
+  Scores every passage against the query terms with BM25, vectorized over a
+  passages x terms frequency matrix.
+  '''
+  terms = list(dict.fromkeys(query_terms))
+  if not passages or not terms:
+    return np.zeros(len(passages))
+
+  term_index = {term: i for i, term in enumerate(terms)}
+  frequencies = np.zeros((len(passages), len(terms)), dtype=np.float32)
+  lengths = np.zeros(len(passages), dtype=np.float32)
+
+  for row, passage in enumerate(passages):
+    tokens = tokenize(passage)
+    lengths[row] = len(tokens)
+    for token in tokens:
+      column = term_index.get(token)
+      if column is not None:
+        frequencies[row, column] += 1
+
+  document_frequency = (frequencies > 0).sum(axis=0)
+  idf = np.log1p((len(passages) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+  average_length = max(float(lengths.mean()), 1.0)
+  normalizer = K1 * (1 - B + B * lengths / average_length)
+  weighted = frequencies * (K1 + 1) / (frequencies + normalizer[:, None])
+
+  return weighted @ idf
+
+def select_passages(sources: List[Source], query: str, keywords: Optional[List[str]] = None, token_budget: int = 3000) -> List[Tuple[int, List[str]]]:
+  '''
+  Picks the passages most relevant to the query that fit in the token budget.
+
+  :return: (source index, passages) pairs in source order, so citation numbers
+           keep pointing at the same source
+  '''
+  candidates: List[Tuple[int, int, str]] = []
+  for i, source in enumerate(sources):
+    content = source.crawled_content or source.snippet
+    if not content:
+      continue
+    for position, passage in enumerate(split_passages(content)):
+      candidates.append((i, position, passage))
+
+  if not candidates:
+    return []
+
+  query_terms = tokenize(" ".join([query] + (keywords or [])))
+  scores = bm25_scores([passage for _, _, passage in candidates], query_terms)
+
+  source_indexes = np.array([i for i, _, _ in candidates], dtype=np.float32)
+  positions = np.array([position for _, position, _ in candidates], dtype=np.float32)
+  scores = scores + RANK_PRIOR / (1 + source_indexes) + RANK_PRIOR / (1 + positions)
+
+  selected = {}
+  used = 0
+  for candidate in np.argsort(-scores, kind="stable"):
+    i, position, passage = candidates[candidate]
+    cost = estimate_tokens(passage)
+    if used + cost > token_budget:
+      continue
+    selected.setdefault(i, []).append((position, passage))
+    used += cost
+
+  return [(i, [passage for _, passage in sorted(selected[i])]) for i in sorted(selected)]
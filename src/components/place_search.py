@@ -5,6 +5,7 @@ import time
 from src.models.place import Place
 
 from ..models.search import Search
+from ..services.http_clients import hedged_get
 from .keys import YELP_API_KEY
 
 async def place_search(search: Search):
@@ -24,9 +25,8 @@ async def place_search(search: Search):
 
   start_time = time.time()
 
-  async with httpx.AsyncClient() as client:
-    response = await client.get(yelp_api, headers=headers, params=parameters)
-    
+  response = await hedged_get("yelp", yelp_api, headers=headers, params=parameters)
+
   places_data = response.json()['businesses']
   
   places = [Place(**place) for place in places_data]
@@ -0,0 +1,193 @@
+from dataclasses import dataclass, field
+import json
+import math
+import re
+from typing import Dict, List, Optional
+
+from .config import QUERY_CLASSIFIER_THRESHOLD, QUERY_CLASSIFIER_WEIGHTS
+
+WORD_PATTERN = re.compile(r"[\w+#.'-]+")
+
+QUESTION_WORDS = {
+  "who", "what", "when", "where", "why", "how", "which", "whose", "whom",
+  "can", "could", "does", "do", "did", "is", "are", "was", "were", "should", "will", "would",
+}
+COMPARISON_TERMS = {"vs", "vs.", "versus", "compare", "comparison", "difference", "differences", "better"}
+NEWS_TERMS = {
+  "news", "latest", "today", "tonight", "yesterday", "update", "updates", "recent", "current",
+  "live", "score", "scores", "election", "elections", "announced", "announcement", "weather",
+}
+TECHNICAL_TERMS = {
+  "javascript", "typescript", "kotlin", "golang", "c++", "c#", "sql", "html", "css", "django",
+  "fastapi", "npm", "docker", "kubernetes", "linux", "bash", "regex", "api", "json", "syntax",
+  "compile", "comprehension", "async",
+}
+# Also everyday words or names ("taylor swift", "rust belt"), only technical next to another technical term
+AMBIGUOUS_TECHNICAL_TERMS = {
+  "python", "java", "swift", "rust", "react", "flask", "node", "pip", "git", "function", "error",
+  "exception", "install", "library", "array", "list", "dict",
+}
+# Words that make a query read as a phrase or question rather than a name ("elon musk", "bitcoin price")
+FUNCTION_WORDS = {
+  "a", "an", "the", "to", "of", "in", "on", "for", "with", "from", "by", "at", "into", "about",
+  "and", "or", "not", "without", "is", "are", "be", "do", "does", "can", "how", "what", "why",
+}
+PRONOUNS = {"i", "me", "my", "mine", "we", "our", "us"}
+PLACE_CUES = ("near me", "nearby", "around me", "close to me", "in my area", "near by")
+BUSINESS_TERMS = {
+  "restaurant", "restaurants", "cafe", "cafes", "coffee", "bar", "bars", "pub", "pubs", "bakery",
+  "bakeries", "pizza", "sushi", "ramen", "tacos", "burger", "burgers", "brunch", "breakfast",
+  "lunch", "dinner", "food", "hotel", "hotels", "motel", "gym", "gyms", "salon", "barber",
+  "spa", "pharmacy", "dentist", "mechanic", "grocery", "supermarket", "italian", "chinese",
+  "mexican", "indian", "thai", "japanese", "korean", "vietnamese", "french", "greek",
+  "mediterranean", "vegan", "vegetarian", "bbq", "steakhouse", "seafood", "dessert", "ice cream",
+}
+# Filler the keyword model drops from place queries, e.g. "Best Italian restaurants near me" -> "italian restaurants"
+PLACE_FILLER = re.compile(r"\b(best|good|great|top|some|the|find|show me|open now)\b|" + "|".join(re.escape(cue) for cue in PLACE_CUES))
+YEAR_PATTERN = re.compile(r"\b(19|20)\d{2}\b")
+
+# Hand-set starting weights, used until a model trained on logged keyword
+# completions is configured with QUERY_CLASSIFIER_WEIGHTS
+# (see scripts/query_classifier.py).
+DEFAULT_WEIGHTS: Dict[str, float] = {
+  "bias": 3.0,
+  "word_count": -0.45,
+  "single_word": -1.5,
+  "question_word": -2.5,
+  "question_mark": -1.0,
+  "capitalized": -3.0,
+  "comparison": -2.0,
+  "conjunction": -1.5,
+  "news_term": -3.0,
+  "year": -1.0,
+  "technical": 1.5,
+  "pronoun": -1.0,
+  "place_cue": -3.0,
+  "business_term": -3.0,
+}
+
+@dataclass
+class QueryClassification:
+  keywords: List[str]
+  search_type: str
+  search_image: bool
+  confidence: float
+  reason: str = field(default="model")
+
+  def to_json(self) -> str:
+    '''
+    Same shape as the keyword model's completion, for `Search.create`
+    '''
+    return json.dumps({
+      "keywords": self.keywords,
+      "search_type": self.search_type,
+      "search_image": self.search_image,
+      "entity": None,
+    })
+
+def tokenize(query: str) -> List[str]:
+  return WORD_PATTERN.findall(query)
+
+def is_technical(lowered: List[str]) -> bool:
+  ambiguous = sum(word in AMBIGUOUS_TECHNICAL_TERMS for word in lowered)
+  return any(word in TECHNICAL_TERMS for word in lowered) or ambiguous >= 2
+
+def may_name_entity(query: str) -> bool:
+  '''
+  Whether the query could be (or contain) the name of something with a
+  knowledge panel. Errs towards yes: a capitalized word, or a short phrase
+  with no function words that isn't technical, e.g. "elon musk" or
+  "tesla stock".
+  '''
+  words = tokenize(query)
+  lowered = [word.lower() for word in words]
+  if any(word[:1].isupper() for word in words):
+    return True
+  if is_technical(lowered):
+    return False
+  return not any(word in FUNCTION_WORDS for word in lowered)
+
+def query_features(query: str) -> Dict[str, float]:
+  '''
+  Features of the linear model, all binary except the word count
+  '''
+  words = tokenize(query)
+  lowered = [word.lower() for word in words]
+  text = " ".join(lowered)
+
+  return {
+    "bias": 1.0,
+    "word_count": float(len(words)),
+    "question_word": float(bool(lowered) and lowered[0] in QUESTION_WORDS),
+    "question_mark": float("?" in query),
+    "single_word": float(len(words) == 1),
+    # Most queries are typed in lowercase, so a capitalized word usually names an entity
+    "capitalized": float(any(word[:1].isupper() for word in words)),
+    "comparison": float(any(word in COMPARISON_TERMS for word in lowered)),
+    "conjunction": float(" and " in f" {text} " or "," in query),
+    "news_term": float(any(word in NEWS_TERMS for word in lowered)),
+    "year": float(bool(YEAR_PATTERN.search(query))),
+    "technical": float(is_technical(lowered)),
+    "pronoun": float(any(word in PRONOUNS for word in lowered)),
+    "place_cue": float(any(cue in text for cue in PLACE_CUES)),
+    "business_term": float(any(word in BUSINESS_TERMS for word in lowered)),
+  }
+
+def load_weights(path: Optional[str] = QUERY_CLASSIFIER_WEIGHTS) -> Dict[str, float]:
+  if not path:
+    return dict(DEFAULT_WEIGHTS)
+  try:
+    with open(path) as file:
+      return json.load(file)
+  except (OSError, ValueError) as e:
+    print(f"Unable to load query classifier weights from {path}, using defaults: {e}")
+    return dict(DEFAULT_WEIGHTS)
+
+_weights = load_weights()
+
+def simple_web_probability(features: Dict[str, float], weights: Optional[Dict[str, float]] = None) -> float:
+  '''
+  Probability that the keyword model would return the query itself as a plain web search
+  '''
+  weights = weights or _weights
+  score = sum(weights.get(name, 0.0) * value for name, value in features.items())
+  return 1 / (1 + math.exp(-score))
+
+def place_keywords(query: str) -> str:
+  return " ".join(PLACE_FILLER.sub(" ", query.lower()).split())
+
+def classify_query(query: str, threshold: float = QUERY_CLASSIFIER_THRESHOLD, weights: Optional[Dict[str, float]] = None) -> Optional[QueryClassification]:
+  '''
+  Classifies a query locally so simple ones can skip the keyword model.
+
+  Local business searches ("sushi near me") are recognised by rules. Other
+  queries are scored by the linear model and only accepted as a plain web
+  search when it is at least `threshold` confident. Queries that may name
+  an entity (see `may_name_entity`) are always left to the keyword model,
+  which picks the entity for the knowledge panel. Returns None whenever
+  the keyword model should decide.
+  '''
+  query = " ".join(query.split())
+  if not query:
+    return None
+
+  features = query_features(query)
+
+  if features["place_cue"] and features["business_term"] and not features["question_word"]:
+    keywords = place_keywords(query)
+    if keywords:
+      return QueryClassification(keywords=[keywords], search_type="place", search_image=True, confidence=1.0, reason="place rule")
+
+  if may_name_entity(query):
+    return None
+
+  probability = simple_web_probability(features, weights)
+  if probability < threshold:
+    return None
+
+  return QueryClassification(
+    keywords=[query.rstrip("?!. ")],
+    search_type="web",
+    search_image=not features["technical"],
+    confidence=probability
+  )
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+async def outcome(task: asyncio.Task) -> Any:
+  '''
+  Waits for a stage task and returns its result, or None if it was cancelled
+  '''
+  await asyncio.wait([task])
+  if task.cancelled():
+    return None
+  return task.result()
+
+class StageScheduler:
+  '''
+  Runs pipeline stages as a dependency graph.
+
+  Each stage declares the stages it takes as inputs and starts the moment
+  they have finished, instead of waiting for a whole phase. Stages without
+  inputs start right away, which is how speculative work is launched.
+  A failed or cancelled stage resolves to None for its dependents, and so
+  does a stage that runs past its deadline.
+  '''
+  def __init__(self):
+    self._tasks: Dict[str, asyncio.Task] = {}
+    self.timings: Dict[str, float] = {}
+    self.timed_out: List[str] = []
+
+  def add(self, name: str, fn: Callable[..., Awaitable[Any]], inputs: Iterable[str] = (), timeout: Optional[float] = None):
+    '''
+    Schedules a stage. Its inputs must already be added, and their results
+    are passed to `fn` as positional arguments in the same order.
+    `timeout` is the stage's own budget, counted from when its inputs are ready.
+    '''
+    dependencies = [self._tasks[dependency] for dependency in inputs]
+    self._tasks[name] = asyncio.create_task(self._run(name, fn, dependencies, timeout))
+
+  async def _run(self, name: str, fn: Callable[..., Awaitable[Any]], dependencies: list, timeout: Optional[float]) -> Any:
+    values = [await outcome(dependency) for dependency in dependencies]
+    start_time = time.time()
+    try:
+      return await asyncio.wait_for(fn(*values), timeout=timeout)
+    except asyncio.TimeoutError:
+      print(f"Stage {name} ran out of its {timeout}s budget")
+      self.timed_out.append(name)
+      return None
+    except Exception as e:
+      print(f"Stage {name} failed: {e}")
+      return None
+    finally:
+      self.timings[name] = time.time() - start_time
+
+  async def result(self, name: str) -> Any:
+    return await outcome(self._tasks[name])
+
+  def peek(self, name: str) -> Any:
+    '''
+    Result of a stage that has already finished, without waiting for one that hasn't
+    '''
+    task = self._tasks.get(name)
+    if task is None or not task.done() or task.cancelled():
+      return None
+    return task.result()
+
+  async def wait(self, names: Iterable[str]):
+    tasks = [self._tasks[name] for name in names]
+    if tasks:
+      await asyncio.wait(tasks)
+
+  async def as_completed(self, names: Iterable[str]) -> AsyncIterator[Tuple[str, Any]]:
+    '''
+    Yields (name, result) for the given stages in the order they finish
+    '''
+    names_by_task = {self._tasks[name]: name for name in names}
+    pending = set(names_by_task)
+    while pending:
+      done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+      for task in done:
+        yield names_by_task[task], None if task.cancelled() else task.result()
+
+  def cancel(self, name: str):
+    task: Optional[asyncio.Task] = self._tasks.get(name)
+    if task and not task.done():
+      task.cancel()
+
+  def cancel_all(self):
+    for name in self._tasks:
+      self.cancel(name)
@@ -1,20 +1,33 @@
 from ..models.search import Source, Search
 from .prompts import SUMMARY_PROMPT
-from .keys import OPENAI_API_KEY
+from .passages import select_passages
+from .config import SUMMARY_CONTEXT_TOKENS
+from ..services import llm
 
 import os
-from openai import AsyncOpenAI
+from typing import Optional
 
-def generate_citations(sources: list[Source]):
-  content = ""
-  for i, source in enumerate(sources):
-    c = source.crawled_content or source.snippet
-    if c is None:
-      continue
-    if i > 0:
-      content += "\n\n----\n\n"
-    content += f"[citation:{i}] {c}"
-  return content
+def generate_citations(sources: list[Source], query: Optional[str] = None, keywords: Optional[list[str]] = None, token_budget: int = SUMMARY_CONTEXT_TOKENS):
+  """
+  Builds the citation context for the summary prompt.
+
+  When a query is given, only the passages that rank best against the query
+  and keywords are kept, up to `token_budget` tokens. Each passage stays
+  under its source's original `[citation:i]` number.
+  """
+  if query is None:
+    parts = []
+    for i, source in enumerate(sources):
+      c = source.crawled_content or source.snippet
+      if c is None:
+        continue
+      parts.append(f"[citation:{i}] {c}")
+    return "\n\n----\n\n".join(parts)
+
+  return "\n\n----\n\n".join(
+    f"[citation:{i}] {' '.join(passages)}"
+    for i, passages in select_passages(sources, query, keywords, token_budget)
+  )
 
 stop_words = [
   # "<|im_end|>",
@@ -34,9 +47,9 @@ stop_words = [
 ]
 
 async def summarise(search: Search, system_prompt: str = SUMMARY_PROMPT, user_prompt: str = None):
-  content = generate_citations(search.sources)
-  
   if not user_prompt:
+    content = generate_citations(search.sources, search.query, search.keywords)
+
     user_prompt = f"Anwer the question '{search.query}' from the given context:\n{content}"
   
   messages = [
@@ -50,23 +63,22 @@ async def summarise(search: Search, system_prompt: str = SUMMARY_PROMPT, user_pr
     },
   ]
 
-  client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
-  chat_completion = await client.chat.completions.create(
-    model="gpt-3.5-turbo-0125",
-    messages=messages,
-    stream=True,
-    stop=stop_words,
-    temperature=0.5
-  )
-
   summary = ""
 
-  async for chunk in chat_completion:
-    text = chunk.choices[0].delta.content
-    # print(text, end="")
-    if text:
-      summary += text
-      yield text
+  async with llm.acquire("openai") as client:
+    chat_completion = await client.chat.completions.create(
+      model="gpt-3.5-turbo-0125",
+      messages=messages,
+      stream=True,
+      stop=stop_words,
+      temperature=0.5
+    )
+
+    async for chunk in chat_completion:
+      text = chunk.choices[0].delta.content
+      # print(text, end="")
+      if text:
+        summary += text
+        yield text
 
   search.summary = summary
\ No newline at end of file
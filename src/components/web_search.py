@@ -1,110 +1,227 @@
-import httpx
 import asyncio
-from typing import List
+from typing import Callable, List, Optional, Tuple
 import os
 import time
 
 from ..models.search import Search, Source
+from ..services.http_clients import hedged_get
+from .cache import MISSING, SingleFlight, TTLCache
+from .config import BRAVE_CACHE_SIZE, BRAVE_CACHE_TTLS, RRF_K, WEB_SEARCH_MAX_SOURCES
+from .helpers import canonicalize_url
 from .keys import BRAVE_API_KEY
 
-async def fetch_search_results(client: httpx.AsyncClient, query: str, search_type: str, search: Search) -> List[dict]:
+class BraveResults:
   """
-  Asynchronously fetch search results for a given query and search type using Brave's search API.
-  
-  Parameters:
-  - client (httpx.AsyncClient): The HTTP client for making requests.
-  - query (str): The search query.
-  - search_type (str): The type of search ("web" or "news").
-  - brave_api_key (str): The API key for Brave search.
+  The parts of a Brave response the app uses, which is all the cache keeps.
 
-  Returns:
-  List[dict]: A list of search results.
+  Sources are stored as field dicts rather than models, because searches
+  mutate their sources (crawling, fusing) and each needs its own copies.
   """
-  url = f"https://api.search.brave.com/res/v1/{search_type}/search"
-  
+  __slots__ = ("sources", "is_geolocal", "city")
+
+  def __init__(self, sources: List[dict], is_geolocal: bool = False, city: Optional[str] = None):
+    self.sources = sources
+    self.is_geolocal = is_geolocal
+    self.city = city
+
+  @classmethod
+  def fromResponse(cls, result: dict, parse: Callable[[dict], List[Source]]) -> "BraveResults":
+    query = result.get('query') or {}
+    return cls(
+      [source.dict() for source in parse(result)],
+      bool(query.get('is_geolocal', False)),
+      query.get('city'),
+    )
+
+  def to_sources(self) -> List[Source]:
+    return [Source(**fields) for fields in self.sources]
+
+brave_cache = TTLCache(max_size=BRAVE_CACHE_SIZE, ttl=BRAVE_CACHE_TTLS["web"])
+brave_in_flight = SingleFlight()
+
+def coarse_location(search: Search) -> Optional[Tuple[float, float]]:
+  """
+  Rounds the search location to roughly 10km so nearby users share cached results.
+  """
+  if not search.geolocation:
+    return None
+  try:
+    return (round(float(search.geolocation.latitude), 1), round(float(search.geolocation.longitude), 1))
+  except (TypeError, ValueError):
+    return None
+
+async def fetch_brave(endpoint: str, params: dict, search: Search, parse: Callable[[dict], List[Source]]) -> BraveResults:
+  """
+  Fetches a Brave API endpoint through the results cache.
+
+  Identical requests that are already in flight share one upstream call, and
+  successful responses are parsed with `parse` and cached, trimmed to the
+  fields the app uses, per (endpoint, query, coarse location).
+  """
+  key = (endpoint, params["q"], coarse_location(search))
+
+  cached = brave_cache.get(key)
+  if cached is not MISSING:
+    search.logs.brave_cache_hits += 1
+    return cached
+  search.logs.brave_cache_misses += 1
+
+  url = f"https://api.search.brave.com/res/v1/{endpoint}/search"
+
   headers = {
     "X-Subscription-Token": BRAVE_API_KEY,
   }
-  
+
   if search.geolocation:
     headers["X-Loc-Lat"] = search.geolocation.latitude
     headers["X-Loc-Long"] = search.geolocation.longitude
+
+  async def request():
+    response = await hedged_get("brave", url, params=params, headers=headers)
+    response.raise_for_status()  # Ensure the request was successful
+    result = BraveResults.fromResponse(response.json(), parse)
+    brave_cache.set(key, result, ttl=BRAVE_CACHE_TTLS.get(endpoint, BRAVE_CACHE_TTLS["web"]))
+    return result
+
+  return await brave_in_flight.do(key, request)
+
+def parse_results(result: dict) -> List[Source]:
+  """
+  Turns a Brave web or news response into its ranked list of sources.
+  """
+  sources = []
+
+  if result.get('type') == "search":
+    for index in result.get('mixed', {}).get('main', []):
+      try:
+        if index['all']:
+          for r in result[index['type']]['results']:
+            sources.append(Source.fromResult(r, index['type']))
+        else:
+          sources.append(Source.fromResult(result[index['type']]['results'][index['index']], index['type']))
+      except (KeyError, IndexError, TypeError, ValueError) as e:
+        print(f"Skipping {index.get('type')} result: {e}")
+  else:
+    for news in result.get('results', []):
+      try:
+        sources.append(Source.fromResult(news, 'news'))
+      except (KeyError, TypeError, ValueError) as e:
+        print(f"Skipping news result: {e}")
+
+  return sources
+
+def parse_image_results(result: dict) -> List[Source]:
+  """
+  Turns a Brave images response into its list of images.
+  """
+  images = []
+
+  for r in result.get('results', []):
+    try:
+      images.append(Source.fromImageResult(r))
+    except (KeyError, TypeError, ValueError) as e:
+      print(f"Skipping image result: {e}")
+
+  return images
+
+async def fetch_search_results(query: str, search_type: str, search: Search) -> BraveResults:
+  """
+  Asynchronously fetch search results for a given query and search type using Brave's search API.
   
-  response = await client.get(url, params={
+  Parameters:
+  - query (str): The search query.
+  - search_type (str): The type of search ("web" or "news").
+  - brave_api_key (str): The API key for Brave search.
+
+  Returns:
+  BraveResults: The ranked sources and whether Brave localised the query.
+  """
+  return await fetch_brave(search_type, {
     "q": query,
     "text_decorations": False,
-  }, headers=headers)
+  }, search, parse_results)
 
-  response.raise_for_status()  # Ensure the request was successful
-  return response.json()
+def fuse_results(ranked_lists: List[List[Source]], limit: int = WEB_SEARCH_MAX_SOURCES, k: int = RRF_K) -> List[Source]:
+  """
+  Merges the per-keyword result lists into one ranking with reciprocal rank fusion.
 
-async def web_search(search: Search):
+  Results are deduplicated by canonical URL, so a page found by several
+  keywords appears once and ranks higher. Fields missing from the first copy
+  are filled in from later ones.
+  """
+  scores = {}
+  merged = {}
+
+  for sources in ranked_lists:
+    seen = set()
+    for rank, source in enumerate(sources):
+      key = canonicalize_url(source.url)
+      if key in seen:
+        continue
+      seen.add(key)
+
+      scores[key] = scores.get(key, 0) + 1 / (k + rank + 1)
+
+      if key not in merged:
+        merged[key] = source
+      else:
+        kept = merged[key]
+        kept.snippet = kept.snippet or source.snippet
+        kept.description = kept.description or source.description
+        kept.thumbnail = kept.thumbnail or source.thumbnail
+
+  # sorted() is stable, so ties keep the order of the first keyword
+  ranking = sorted(merged, key=lambda key: -scores[key])
+  return [merged[key] for key in ranking[:limit]]
+
+async def speculative_web_results(search: Search) -> List[Source]:
+  """
+  Fetches results for the raw query while keywords are still being generated.
+  """
+  search_type = "news" if "news" in search.query.lower().split(' ') else "web"
+  result = await fetch_search_results(search.query, search_type, search)
+  return result.to_sources()
+
+async def web_search(search: Search, extra_results: Optional[Callable[[], List[List[Source]]]] = None):
   """
   Perform parallel API calls to Brave for each query in the list and return a combined list of sources.
   
   Parameters:
   - queries (List[str]): A list of search queries.
   - brave_api_key (str): The API key for Brave search.
+  - extra_results (Callable, optional): Returns ranked lists fetched elsewhere, fused in with the keyword results.
+    Called once the keyword results are in, so it can include whatever arrived in the meantime.
 
   Returns:
   List[Source]: A combined list of sources from all queries.
   """
-  sources = []
   search_type = "web"
 
   start_time = time.time()
 
-  async with httpx.AsyncClient() as client:
-    tasks = [fetch_search_results(client, keyword, search_type if "news" not in keyword.split(' ') else "news", search) for keyword in search.keywords]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+  tasks = [fetch_search_results(keyword, search_type if "news" not in keyword.split(' ') else "news", search) for keyword in search.keywords]
+  results = await asyncio.gather(*tasks, return_exceptions=True)
 
-  try:
-    for result in results:
-      if result['type'] == "search":
-        for index in result['mixed']['main']:
-          if index['all']:
-            for r in result[index['type']]['results']:
-              source = Source.fromResult(r, index['type'])
-              sources.append(source)
-          else:
-            source = Source.fromResult(result[index['type']]['results'][index['index']], index['type'])
-            sources.append(source)
-      else:
-        for news in result.get('results', []):
-          sources.append(Source.fromResult(news, 'news'))
-  except Exception as e:
-    print(f"Error during Web Search: {e}")
-    
-  if not search.location_used and result.get('query') and result['query'].get('is_geolocal', False):
-    search.location_used = result['query'].get('city') or search.geolocation.city
-
-  search.sources = sources
-  search.logs.web_search_time = time.time() - start_time
+  ranked_lists = []
+  for result in results:
+    if isinstance(result, Exception):
+      print(f"Error during Web Search: {result}")
+      continue
 
-async def image_search(search: Search):
-  url = "https://api.search.brave.com/res/v1/images/search"
-
-  start_time = time.time()
-  
-  headers = {
-    "X-Subscription-Token": BRAVE_API_KEY,
-  }
-  
-  if search.geolocation:
-    headers["X-Loc-Lat"] = search.geolocation.latitude
-    headers["X-Loc-Long"] = search.geolocation.longitude
+    ranked_lists.append(result.to_sources())
 
-  async with httpx.AsyncClient() as client:
-    response = await client.get(url, params={
-      "q": search.keywords[0]
-    }, headers=headers)
+    if not search.location_used and result.is_geolocal:
+      search.location_used = result.city or search.geolocation.city
 
-  result = response.json()
+  search.sources = fuse_results(ranked_lists + (extra_results() if extra_results else []))
+  search.logs.web_search_time = time.time() - start_time
 
-  images = []
+async def image_search(search: Search, query: Optional[str] = None):
+  start_time = time.time()
 
-  for r in result['results']:
-    images.append(Source.fromImageResult(r))
+  result = await fetch_brave("images", {
+    "q": query or search.keywords[0]
+  }, search, parse_image_results)
 
-  search.images = images
+  search.images = result.to_sources()
   search.logs.image_search_time = time.time() - start_time
\ No newline at end of file
@@ -9,6 +9,7 @@ from newspaper import Config as NewspaperConfig
 
 from src.components.helpers import extract_gnews_article_id, generate_id, parse_date_to_milliseconds
 from ..services.database import mongo_client
+from ..services import write_queue
 
 class Article(BaseModel):
   id: str
@@ -85,6 +86,8 @@ class Article(BaseModel):
   @staticmethod
   async def get(article_id: str) -> Optional["Article"]:
     try:
+      # A queued link to its thread has to land before the article is read
+      await write_queue.settle("articles", article_id)
       data = await mongo_client.quest.articles.find_one({"id": article_id})
       return Article(**data)
     except Exception as e:
@@ -102,14 +105,14 @@ class Article(BaseModel):
       print(f"Error saving article: {e}")
       
   async def link_to_thread(self, thread):
-    try:
-      await mongo_client.quest.articles.update_one({"id": self.id}, {"$set": {
-        "thread_id": thread.id,
-        "title": thread.searches[-1].query,
-        "summary": thread.searches[-1].summary,
-      }})
-    except Exception as e:
-      print(f"Error linking article to thread: {e}")
+    '''
+    Queues the update that links the article to its summary thread
+    '''
+    await write_queue.update("articles", self.id, {"id": self.id}, {"$set": {
+      "thread_id": thread.id,
+      "title": thread.searches[-1].query,
+      "summary": thread.searches[-1].summary,
+    }})
     
   @staticmethod
   async def gnews_exists(url: str) -> bool:
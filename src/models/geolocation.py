@@ -1,9 +1,14 @@
 from fastapi import WebSocket
 from pydantic import BaseModel
-import httpx
 from typing import Optional
 
+from ..components.cache import MISSING, TTLCache
+from ..components.config import GEOIP_CACHE_SIZE, GEOIP_CACHE_TTL, GEOIP_NEGATIVE_CACHE_TTL
 from ..components.keys import IPGEO_API_KEY
+from ..services.http_clients import hedged_get
+from ..services import geoip
+
+_geolocation_cache = TTLCache(max_size=GEOIP_CACHE_SIZE, ttl=GEOIP_CACHE_TTL)
 
 def get_client_ip_websocket(websocket: WebSocket, trust_x_forwarded_for: bool = False) -> Optional[str]:
   """
@@ -34,6 +39,27 @@ class Geolocation(BaseModel):
   
   @staticmethod
   async def get(ip) -> Optional['Geolocation']:
+    '''
+    Resolves the location of an IP address. The in-process cache is checked
+    first, then the offline IP range database, and the ipgeolocation API is
+    only called when neither has an answer.
+    '''
+    cached = _geolocation_cache.get(ip)
+    if cached is not MISSING:
+      return cached.copy() if cached else None
+
+    offline = geoip.lookup(ip)
+    if offline:
+      geolocation = Geolocation(**offline)
+      _geolocation_cache.set(ip, geolocation)
+      return geolocation.copy()
+
+    geolocation = await Geolocation.fetch(ip)
+    _geolocation_cache.set(ip, geolocation, ttl=None if geolocation else GEOIP_NEGATIVE_CACHE_TTL)
+    return geolocation.copy() if geolocation else None
+
+  @staticmethod
+  async def fetch(ip) -> Optional['Geolocation']:
     url = 'https://api.ipgeolocation.io/ipgeo'
     headers = {'Content-Type': 'application/json'}
     params = {
@@ -41,19 +67,18 @@ class Geolocation(BaseModel):
       "apiKey": IPGEO_API_KEY
     }
 
-    async with httpx.AsyncClient() as client:
-      response = await client.get(url, params=params, headers=headers)
-      
-      json = response.json()
-
-      if response.status_code == 200:
-        return Geolocation(
-          country=json.get('country_name'),
-          city=json.get('city'),
-          latitude=json.get('latitude'),
-          longitude=json.get('longitude'),
-          zipcode=json.get('zipcode')
-        )
-      else:
-        print(f"Failed to get geolocation for IP {ip}: {json}")
-        return None
\ No newline at end of file
+    response = await hedged_get("ipgeolocation", url, params=params, headers=headers)
+
+    json = response.json()
+
+    if response.status_code == 200:
+      return Geolocation(
+        country=json.get('country_name'),
+        city=json.get('city'),
+        latitude=json.get('latitude'),
+        longitude=json.get('longitude'),
+        zipcode=json.get('zipcode')
+      )
+    else:
+      print(f"Failed to get geolocation for IP {ip}: {json}")
+      return None
\ No newline at end of file
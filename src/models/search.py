@@ -3,6 +3,7 @@ import time
 from typing import Optional, List
 from pydantic import BaseModel
 import json
+import re
 
 from src.models.place import Place
 
@@ -10,6 +11,16 @@ from .source import Source
 from .geolocation import Geolocation
 from ..components.helpers import generate_id
 from ..services.database import mongo_client
+from ..services import write_queue
+from ..components.config import CONTEXT_DIGEST_TOKENS, CONTEXT_RECENT_TURNS, THREAD_APPEND_ONLY, THREAD_SAVE_ATTEMPTS
+from ..components.passages import estimate_tokens
+
+# How much of each previous search goes into the context of a follow-up
+CONTEXT_SOURCES = 10
+CONTEXT_PLACES = 5
+
+CITATION_PATTERN = re.compile(r"\s*\[\d+\]")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
 
 class SearchType(Enum):
   WEB = "web"
@@ -25,9 +36,147 @@ class SearchLog(BaseModel):
   image_search_time: Optional[float] = 0
   knowledge_panel_time: Optional[float] = 0
   place_search_time: Optional[float] = 0
+  crawl_time: Optional[float] = 0
+
+  crawl_attempted: Optional[int] = 0
+  crawled_sources: Optional[int] = 0
+  cache_hits: Optional[int] = 0 # Keyword cache
+  cache_misses: Optional[int] = 0
+  brave_cache_hits: Optional[int] = 0
+  brave_cache_misses: Optional[int] = 0
+  timed_out_stages: list[str] = []
+  classifier_confidence: Optional[float] = None
 
   raw_keywords: Optional[str] = None
   
+class SearchContext(BaseModel):
+  '''
+  The parts of a saved search that follow-up searches read. Lazily loaded
+  threads get these from a projection instead of full `Search` models.
+  '''
+  query: str
+  search_type: Optional[SearchType] = SearchType.WEB
+  summary: Optional[str] = None
+  sources: List[dict] = [] # Title and snippet of the top sources
+  places: List[Place] = []
+  knowledge_panel_label: Optional[str] = None
+
+  @classmethod
+  def fromSearch(cls, search: "Search") -> "SearchContext":
+    return cls(
+      query=search.query,
+      search_type=search.search_type,
+      summary=search.summary,
+      sources=[{'title': source.title, 'snippet': source.snippet} for source in search.sources[:CONTEXT_SOURCES]],
+      places=search.places[:CONTEXT_PLACES],
+      knowledge_panel_label=search.knowledge_panel.get('label') if search.knowledge_panel else None
+    )
+
+  def get_context(self) -> str:
+    context = f"{self.query}\n"
+    if self.search_type == SearchType.WEB:
+      if self.summary and self.summary != "":
+        context += self.summary
+      else:
+        for source in self.sources:
+          context += f"{source.get('title')}\n{source.get('snippet')}\n"
+    elif self.search_type == SearchType.PLACE:
+      for place in self.places:
+        context += place.generate_context() + "---\n"
+    return context
+
+def compact_context(context: SearchContext, max_chars: int = 200) -> str:
+  '''
+  One line standing in for a search that has dropped out of the recent turns
+  '''
+  if context.search_type == SearchType.PLACE:
+    detail = ", ".join(place.name for place in context.places[:3])
+  elif context.summary:
+    detail = " ".join(CITATION_PATTERN.sub("", context.summary).split())
+    detail = SENTENCE_END.split(detail, maxsplit=1)[0]
+  else:
+    detail = "; ".join(source.get('title') or "" for source in context.sources[:2])
+
+  line = f"- {context.query}: {detail}" if detail else f"- {context.query}"
+  return line if len(line) <= max_chars else line[:max_chars - 3].rstrip() + "..."
+
+class DigestTurn(BaseModel):
+  context: str # get_context() of the search, truncated to the per-turn budget
+  compact: str # Line that replaces it once the turn is no longer recent
+
+class ContextDigest(BaseModel):
+  '''
+  Rolling context of a thread for keyword generation: the last
+  CONTEXT_RECENT_TURNS searches verbatim and one compact line for each
+  older search, kept within CONTEXT_DIGEST_TOKENS. Updated as searches are
+  added, so building the prompt doesn't depend on the thread's length.
+  '''
+  recent: List[DigestTurn] = []
+  earlier: List[str] = [] # Oldest first
+  omitted: int = 0 # Older searches dropped to stay within the budget
+  turns: int = 0
+
+  def add(self, context: SearchContext, recent_turns: int = CONTEXT_RECENT_TURNS, token_budget: int = CONTEXT_DIGEST_TOKENS):
+    # Recent turns share the budget with the compact lines of older ones
+    max_chars = token_budget * 4 // (recent_turns + 1)
+    text = context.get_context()
+    if len(text) > max_chars:
+      text = text[:max_chars].rstrip() + "..."
+
+    self.recent.append(DigestTurn(context=text, compact=compact_context(context)))
+    self.turns += 1
+
+    while len(self.recent) > recent_turns:
+      self.earlier.append(self.recent.pop(0).compact)
+
+    while self.earlier and estimate_tokens(self.text()) > token_budget:
+      self.earlier.pop(0)
+      self.omitted += 1
+
+  def text(self) -> str:
+    context = ""
+    if self.earlier:
+      context += "Earlier searches:\n" + "\n".join(self.earlier) + "\n\n"
+    for turn in self.recent:
+      context += turn.context + "\n"
+    return context
+
+def thread_view_pipeline(thread_id: str) -> list:
+  '''
+  Aggregation that loads a thread with a `SearchContext` per search instead
+  of the searches themselves. Threads with a digest only need their last few
+  searches, the rest are summarised in the digest.
+  '''
+  searches = {"$ifNull": ["$searches", []]}
+  return [
+    {"$match": {"id": thread_id}},
+    {"$project": {
+      "id": 1,
+      "user_id": 1,
+      "created_at": 1,
+      "updated_at": 1,
+      "version": 1,
+      "digest": 1,
+      "turns": {"$size": searches},
+      "context": {"$map": {
+        "input": {"$cond": [{"$ifNull": ["$digest", False]}, {"$slice": [searches, -CONTEXT_RECENT_TURNS]}, searches]},
+        "as": "search",
+        "in": {
+          "query": "$$search.query",
+          "search_type": "$$search.search_type",
+          "summary": "$$search.summary",
+          "sources": {"$map": {
+            "input": {"$slice": [{"$ifNull": ["$$search.sources", []]}, CONTEXT_SOURCES]},
+            "as": "source",
+            "in": {"title": "$$source.title", "snippet": "$$source.snippet"}
+          }},
+          "places": {"$slice": [{"$ifNull": ["$$search.places", []]}, CONTEXT_PLACES]},
+          "knowledge_panel_label": "$$search.knowledge_panel.label"
+        }
+      }}
+    }}
+  ]
+
 class Search(BaseModel):
   thread_id: str
   query: str
@@ -62,17 +211,7 @@ class Search(BaseModel):
     )
 
   def get_context(self) -> str:
-    context = f"{self.query}\n"
-    if self.search_type == SearchType.WEB:
-      if self.summary and self.summary != "":
-        context += self.summary
-      else:
-        for source in self.sources[:10]:
-          context += f"{source.title}\n{source.snippet}\n"
-    elif self.search_type == SearchType.PLACE:
-      for place in self.places[:5]:
-        context += place.generate_context() + "---\n"
-    return context
+    return SearchContext.fromSearch(self).get_context()
   
   def clientJSON(self) -> str:
     return json.dumps({
@@ -118,6 +257,15 @@ class Thread(BaseModel):
   created_at: float # Seconds since epoch
   searches: List[Search] = []
   is_new: Optional[bool] = True
+  # Bumped on every write. Threads saved before versioning have none, and `{"version": None}` matches them too.
+  version: Optional[int] = None
+  updated_at: Optional[float] = None
+  saved_searches: Optional[int] = 0 # Entries of `searches` already persisted, not stored
+  # Lazily loaded threads only hold the searches added since loading, plus the projected context of the saved ones
+  context: List[SearchContext] = []
+  turns: Optional[int] = None # Saved searches of a lazily loaded thread, `context` may only hold the last few
+  searches_loaded: Optional[bool] = True
+  digest: Optional[ContextDigest] = None
   
   @classmethod
   def create(cls) -> "Thread":
@@ -130,7 +278,62 @@ class Thread(BaseModel):
     )
 
   def add(self, search: Search):
+    digest = self.context_digest()
     self.searches.append(search)
+    digest.add(SearchContext.fromSearch(search))
+
+  def context_digest(self) -> ContextDigest:
+    '''
+    The thread's digest, built from its history for threads saved before digests existed
+    '''
+    if self.digest is None:
+      digest = ContextDigest()
+      for context in self.history():
+        digest.add(context)
+      self.digest = digest
+    return self.digest
+
+  def rebase_digest(self, stored: Optional[dict], added: List[Search]):
+    '''
+    Replaces the digest with the stored one plus the searches this save adds.
+    Without a stored digest it is cleared, and rebuilt from the full history
+    the next time the thread is loaded.
+    '''
+    if stored is None:
+      self.digest = None
+      return
+    digest = ContextDigest(**stored)
+    for search in added:
+      digest.add(SearchContext.fromSearch(search))
+    self.digest = digest
+
+  @property
+  def turn_count(self) -> int:
+    if self.searches_loaded:
+      return len(self.searches)
+    saved = self.turns if self.turns is not None else len(self.context)
+    return saved + len(self.searches)
+
+  def history(self) -> List[SearchContext]:
+    '''
+    Context of every search in the thread, without loading saved searches
+    '''
+    added = [SearchContext.fromSearch(search) for search in self.searches]
+    return added if self.searches_loaded else self.context + added
+
+  async def load_searches(self):
+    '''
+    Loads the full saved searches of a lazily loaded thread
+    '''
+    if self.searches_loaded:
+      return
+    data = await mongo_client.quest.threads.find_one({"id": self.id}, {"searches": 1})
+    saved = [Search(**search) for search in (data or {}).get("searches", [])]
+    self.searches = saved + self.searches
+    self.saved_searches += len(saved)
+    self.context = []
+    self.turns = None
+    self.searches_loaded = True
     
   def dict(self):
     return {
@@ -138,29 +341,117 @@ class Thread(BaseModel):
       'id': self.id,
       'user_id': self.user_id,
       'created_at': self.created_at,
+      'updated_at': self.updated_at,
+      'version': self.version,
+      'digest': self.digest.dict() if self.digest else None,
       'searches': [search.dict() for search in self.searches]
     }
+
+  def metadata(self) -> dict:
+    return {
+      'user_id': self.user_id,
+      'updated_at': self.updated_at,
+      'digest': self.digest.dict() if self.digest else None,
+    }
     
+  def whole_document(self) -> dict:
+    document = self.dict()
+    document['version'] = (self.version or 0) + 1
+    return document
+
+  def mark_saved(self, version: int):
+    self.version = version
+    self.is_new = False
+    self.saved_searches = len(self.searches)
+
   async def save(self):
-    if self.is_new:
-      try:
-        await mongo_client.quest.threads.insert_one(self.dict())
-      except Exception as e:
-        print(f"Error saving thread: {e}")
-    else:
-      try:
-        await mongo_client.quest.threads.update_one({"id": self.id}, {"$set": self.dict()})
-      except Exception as e:
-        print(f"Error updating thread: {e}")
+    '''
+    Inserts a new thread, or appends the searches added since it was loaded.
+
+    Existing threads are updated with `$push` for the new searches and `$set`
+    for the metadata only, guarded by the version the thread was read at.
+    If another turn was saved in between, the version is re-read and the
+    append is retried, since appends from concurrent turns don't conflict.
+    With THREAD_APPEND_ONLY off the whole document is rewritten as before.
+    Raises when the thread couldn't be written, so the write queue retries.
+    '''
+    self.updated_at = time.time()
+
+    if self.is_new or not THREAD_APPEND_ONLY:
+      # Both write the whole document
+      await self.load_searches()
+      document = self.whole_document()
+      if self.is_new:
+        await mongo_client.quest.threads.insert_one(document)
+      else:
+        await mongo_client.quest.threads.update_one({"id": self.id}, {"$set": document})
+      self.mark_saved(document['version'])
+      return
+
+    added = self.searches[self.saved_searches:]
+    update = {"$set": self.metadata(), "$inc": {"version": 1}}
+    if added:
+      update["$push"] = {"searches": {"$each": [search.dict() for search in added]}}
+
+    for _ in range(THREAD_SAVE_ATTEMPTS):
+      result = await mongo_client.quest.threads.update_one({"id": self.id, "version": self.version}, update)
+      if result.matched_count:
+        self.mark_saved((self.version or 0) + 1)
+        return
+
+      current = await mongo_client.quest.threads.find_one({"id": self.id}, {"version": 1, "digest": 1})
+      if current is None:
+        print(f"Thread {self.id} no longer exists, not saving")
+        return
+      self.version = current.get("version")
+      # Our digest was built on the stale read, so it lacks the searches saved in between
+      self.rebase_digest(current.get("digest"), added)
+      update["$set"] = self.metadata()
+    raise RuntimeError(f"Gave up saving thread {self.id} after {THREAD_SAVE_ATTEMPTS} version conflicts")
     
+  async def save_later(self):
+    '''
+    Queues the thread's write on the write-behind queue.
+
+    Whole-document writes (new threads, or every save with THREAD_APPEND_ONLY
+    off) are queued as upserting replacements and go out in the queue's bulk
+    writes. Appends to existing threads need the result of their version
+    check, so they run `save` as a job. Queued appends of the same thread
+    object are coalesced into one.
+    '''
+    if not self.is_new and THREAD_APPEND_ONLY:
+      await write_queue.put_job("threads", self.id, self.save, owner=self)
+      return
+
+    self.updated_at = time.time()
+    await self.load_searches()
+    document = self.whole_document()
+    upsert = self.is_new
+    # Marked saved when queued, so appends queued after it are guarded by its version
+    self.mark_saved(document['version'])
+    await write_queue.replace("threads", self.id, {"id": self.id}, document, upsert=upsert)
+
   @staticmethod
-  async def get(thread_id: str, user_id: Optional[str] = None):
+  async def get(thread_id: str, user_id: Optional[str] = None, lazy: bool = False):
+    '''
+    Loads a thread. With `lazy` only the context of its searches is fetched,
+    through a projection, and `load_searches` loads the rest on demand.
+    '''
     try:
-      data = await mongo_client.quest.threads.find_one({"id": thread_id})
-      thread = Thread(**data)
+      # Saves of the thread that are still queued have to land before it is read
+      await write_queue.settle("threads", thread_id)
+      if lazy:
+        documents = await mongo_client.quest.threads.aggregate(thread_view_pipeline(thread_id)).to_list(1)
+        thread = Thread(**documents[0], searches_loaded=False)
+      else:
+        data = await mongo_client.quest.threads.find_one({"id": thread_id})
+        thread = Thread(**data)
+        thread.saved_searches = len(thread.searches)
       thread.is_new = False
       
       if user_id != thread.user_id:
+        # The copy is inserted as a new document, which needs every search
+        await thread.load_searches()
         thread.user_id = user_id
         thread.id = generate_id(6)
         thread.is_new = True
@@ -1,34 +1,106 @@
 import asyncio
-from typing import Optional
+from typing import NamedTuple, Optional
 import httpx
 from pydantic import BaseModel, HttpUrl
-from bs4 import BeautifulSoup, Comment
 
 from src.models.article import Article
+from ..services.http_clients import get_client
+from ..services import extraction
+from ..services.tiered_cache import TieredCache
+from ..components.config import CRAWL_CACHE_FRESH_FOR, CRAWL_CACHE_MAX_AGE, CRAWL_CACHE_SIZE, CRAWL_CONTENT_TYPES, CRAWL_MAX_BYTES
+from ..components.helpers import canonicalize_url
+
+crawled_page_cache = TieredCache("crawled_pages", max_size=CRAWL_CACHE_SIZE, max_age=CRAWL_CACHE_MAX_AGE)
 
 class TimeoutException(Exception):
   pass
 
+def is_html(content_type: Optional[str]) -> bool:
+  if not content_type:
+    # Plenty of servers omit the header, let the parser decide
+    return True
+  return content_type.split(";")[0].strip().lower() in CRAWL_CONTENT_TYPES
+
+class Download(NamedTuple):
+  body: Optional[bytes] = None
+  encoding: Optional[str] = None
+  etag: Optional[str] = None
+  last_modified: Optional[str] = None
+  not_modified: bool = False
+
+async def download_html(url: str, max_bytes: int = CRAWL_MAX_BYTES, headers: Optional[dict] = None) -> Optional[Download]:
+  """
+  Streams an HTML page, returning its body, declared encoding and validators.
+
+  Non-HTML responses are rejected from their headers before the body is
+  read, and the download stops once `max_bytes` have arrived. The truncated
+  tail of a long page is almost always navigation and footers.
+  """
+  async with get_client("crawler").stream("GET", url, headers=headers) as response:
+    if response.status_code == 304:
+      return Download(not_modified=True)
+
+    response.raise_for_status()
+
+    if not is_html(response.headers.get("content-type")):
+      return None
+
+    chunks = []
+    size = 0
+    async for chunk in response.aiter_bytes():
+      chunks.append(chunk)
+      size += len(chunk)
+      if size >= max_bytes:
+        break
+
+    return Download(
+      body=b"".join(chunks)[:max_bytes],
+      encoding=response.charset_encoding,
+      etag=response.headers.get("etag"),
+      last_modified=response.headers.get("last-modified")
+    )
+
 async def async_fetch_and_parse(url: str) -> Optional[str]:
+  """
+  Fetches and extracts a page through the crawled content cache.
+
+  Fresh cache entries are returned without a request. Stale entries are
+  revalidated with a conditional GET, so unchanged pages cost a 304 and no
+  parsing.
+  """
+  key = canonicalize_url(url)
+
   try:
-    async with httpx.AsyncClient(timeout=1.5) as client:
-      response = await client.get(url)
-    response.raise_for_status()
-    
-    # Parse the HTML content
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    for tag in soup(['script', 'style', 'header', 'footer', 'nav', 'aside']):
-      tag.decompose()
+    cached = await crawled_page_cache.get(key)
+    if cached is not None and cached.is_fresh:
+      return cached.value
+
+    headers = {}
+    if cached is not None:
+      if cached.meta.get("etag"):
+        headers["If-None-Match"] = cached.meta["etag"]
+      if cached.meta.get("last_modified"):
+        headers["If-Modified-Since"] = cached.meta["last_modified"]
 
-    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-      comment.extract()
+    download = await download_html(url, headers=headers or None)
+    if not download:
+      return None
+
+    if download.not_modified and cached is not None:
+      crawled_page_cache.set(key, cached.value, fresh_for=CRAWL_CACHE_FRESH_FOR, meta=cached.meta)
+      return cached.value
+    
+    # Parse the HTML content off the event loop
+    content = await extraction.extract(download.body, download.encoding)
 
-    for tag in soup.find_all(['div', 'section'], {'class': ['advertisement', 'promo', 'ad-banner']}):
-      tag.decompose()
+    if content:
+      crawled_page_cache.set(key, content, fresh_for=CRAWL_CACHE_FRESH_FOR, meta={
+        "url": url,
+        "etag": download.etag,
+        "last_modified": download.last_modified,
+      })
 
-    clean_text = soup.get_text(separator=' ', strip=True)
-    return clean_text
+    return content
   except Exception as e:
     print(f"An error occurred: {e}")
     return None
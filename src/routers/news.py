@@ -16,7 +16,7 @@ async def get_articles(topic: str):
   '''
   Gets latest news articles by topic
   '''
-  docs = await mongo_client.quest.articles.find({"topic": topic}).sort("publish_date", pymongo.DESCENDING).to_list(10)
+  docs = await mongo_client.quest.articles.find({"topic": topic}).sort("publish_date", pymongo.DESCENDING).limit(10).to_list(10)
   
   articles = []
   
@@ -1,83 +1,289 @@
-from .components.build_search import build_search, rewrite_headline
+from .components.build_search import build_search, normalize_query, rewrite_headline
+from .components.broadcast import StreamBroadcast
 from .components.place_search import place_search
-from .components.web_search import web_search, image_search
+from .components.web_search import web_search, image_search, speculative_web_results
 from .components.knowledge import generate_knowledge_panel
 from .components.summarise import summarise
+from .components.crawl_sources import crawl_sources
+from .components.scheduler import StageScheduler
+from .components.events import PROTOCOL_VERSION, encode_event
+from .components.config import CRAWL_DEADLINE, STAGE_DEADLINES
 from .components.follow_ups import generate_follow_ups
 from .components.prompts import REVIEW_SUMMARY_PROMPT
 from .models.search import Search, SearchLog, Thread, SearchType
 from .models.geolocation import Geolocation
 from .models.article import Article
 from .models.source import Source
+from .services import http_clients
 
 import asyncio
 import json
+import time
+from typing import Dict, List, Optional, Tuple
 
-async def quest_search(query: str, thread: Thread, ip: str):
-  tasks = [
-    build_search(query, thread),
-    Geolocation.get(ip)
-  ]
-  
-  search, geolocation = await asyncio.gather(*tasks, return_exceptions=True)
-  
-  search.geolocation = geolocation
-  if search.search_type == SearchType.PLACE and (not geolocation or (geolocation and (geolocation.city is None or (geolocation.latitude is None and geolocation.longitude is None)))):
-    # print('Unable to determine location. Falling back to web search.')
-    search.search_type = SearchType.WEB
-    search.warnings.append("Please enable location services to get more accurate results.")
+# Context-free searches that are currently running, keyed by normalized query and city
+_in_flight_searches: Dict[tuple, Tuple[StreamBroadcast, Thread]] = {}
 
-  tasks = []
+def provisional_search(query: str, thread: Thread, geolocation: Geolocation) -> Search:
+  """
+  Search used by speculative stages, which run before the real search has been built
+  """
+  return Search(
+    thread_id=thread.id,
+    query=query,
+    keywords=[query],
+    logs=SearchLog(),
+    geolocation=geolocation
+  )
 
-  if search.search_type is SearchType.WEB:
-    tasks.append(web_search(search))
-  elif search.search_type is SearchType.PLACE:
-    tasks.append(place_search(search))
+async def search_events(query: str, thread: Thread, ip: str):
+  """
+  Runs the search pipeline and yields (event, data) pairs as each part completes.
+  The internal "ready" event carries the search once its initial parts are in.
+  """
+  started_at = time.time()
+  scheduler = StageScheduler()
 
-  if search.search_image and search.search_type is SearchType.WEB:
-    tasks.append(image_search(search))
-    
-  if search.entity:
-    tasks.append(generate_knowledge_panel(search.entity, "en"))
+  async def prepare(search: Search, geolocation: Geolocation):
+    search.geolocation = geolocation
+    if search.search_type == SearchType.PLACE and (not geolocation or (geolocation and (geolocation.city is None or (geolocation.latitude is None and geolocation.longitude is None)))):
+      # print('Unable to determine location. Falling back to web search.')
+      search.search_type = SearchType.WEB
+      search.warnings.append("Please enable location services to get more accurate results.")
+    elif search.search_type == SearchType.PLACE and not http_clients.is_available("yelp"):
+      # Yelp is failing, go straight to the web results instead of waiting for an empty place search
+      search.search_type = SearchType.WEB
 
-  results = await asyncio.gather(*tasks, return_exceptions=True)
-  
-  knowledge_panel = results.pop() if search.entity else None
-  if knowledge_panel:
-    if len(thread.searches) == 0:
-      search.knowledge_panel = knowledge_panel
-    elif len(thread.searches) > 0:
-      if thread.searches[-1].knowledge_panel and thread.searches[-1].knowledge_panel['label'] != knowledge_panel['label']:
-        search.knowledge_panel = knowledge_panel
-      else:
-        search.knowledge_panel = knowledge_panel
-      
-  yield search.clientJSON() + "\n"
-  
-  if search.search_type is SearchType.PLACE and len(search.places) == 0:
-    search.search_type = SearchType.WEB
-    await web_search(search)
-    
-  
-  background_task = asyncio.create_task(generate_follow_ups(search))
+    # Speculative results are only useful for web searches
+    if search.search_type is not SearchType.WEB:
+      scheduler.cancel("speculative_web")
+      scheduler.cancel("speculative_images")
+    elif not search.search_image:
+      scheduler.cancel("speculative_images")
+    return search
+
+  async def speculative_web(geolocation: Geolocation):
+    return await speculative_web_results(provisional_search(query, thread, geolocation))
+
+  async def speculative_images(geolocation: Geolocation):
+    speculative_search = provisional_search(query, thread, geolocation)
+    await image_search(speculative_search, query=query)
+    return speculative_search.images
+
+  def speculative_sources() -> List[List[Source]]:
+    # Only fused if the raw query's results came in before the keyword results
+    sources = scheduler.peek("speculative_web")
+    scheduler.cancel("speculative_web")
+    return [sources] if sources else []
+
+  async def results(search: Search):
+    if search.search_type is SearchType.WEB:
+      await web_search(search, extra_results=speculative_sources)
+    elif search.search_type is SearchType.PLACE:
+      await place_search(search)
+      if len(search.places) == 0:
+        search.search_type = SearchType.WEB
+        await web_search(search)
+
+  async def images(search: Search):
+    if not search.search_image or search.search_type is not SearchType.WEB:
+      return
+    if speculate and normalize_query(search.keywords[0]) == normalize_query(query):
+      # The same request as the speculative stage, so it joins it in flight or hits the cache
+      await image_search(search, query=query)
+    else:
+      # The speculative images are for a different query than the one searched
+      scheduler.cancel("speculative_images")
+      await image_search(search)
+
+  async def knowledge(search: Search):
+    if search.entity:
+      # Shielded so a panel that misses the deadline still finishes and lands in the cache
+      return await asyncio.shield(generate_knowledge_panel(search.entity, "en"))
+
+  async def crawl(search: Search, _):
+    if search.search_type is SearchType.WEB:
+      await crawl_sources(search, deadline=started_at + CRAWL_DEADLINE)
+
+  async def summary(search: Search, _):
+    if search.search_type is SearchType.WEB:
+      async for word in summarise(search):
+        await updates.put(("delta", word))
+
+  async def follow_ups(search: Search, _):
+    await generate_follow_ups(search)
+
+  async def watch(names: List[str]):
+    async for stage, result in scheduler.as_completed(names):
+      await updates.put((stage, result))
+
+  # Stages start as soon as their inputs are ready. The raw query goes to
+  # Brave while the keyword LLM call is still running; the speculative
+  # stages are cancelled in `prepare` once the search type shows they aren't needed.
+  # The keyword results don't wait for the speculative ones, which are only
+  # fused in if they arrived first.
+  # Crawling, the summary and the follow-ups only need the results, so the
+  # summary can start streaming before the images or knowledge panel are in.
+  # Follow-ups depend on the thread's context, so the raw query alone isn't worth searching.
+  speculate = thread.turn_count == 0
+  scheduler.add("search", lambda: build_search(query, thread))
+  scheduler.add("geolocation", lambda: Geolocation.get(ip), timeout=STAGE_DEADLINES["geolocation"])
+  if speculate:
+    scheduler.add("speculative_web", speculative_web, inputs=["geolocation"], timeout=STAGE_DEADLINES["speculative_web"])
+    scheduler.add("speculative_images", speculative_images, inputs=["geolocation"], timeout=STAGE_DEADLINES["speculative_images"])
+  scheduler.add("prepare", prepare, inputs=["search", "geolocation"])
+  scheduler.add("results", results, inputs=["prepare"], timeout=STAGE_DEADLINES["results"])
+  scheduler.add("images", images, inputs=["prepare"], timeout=STAGE_DEADLINES["images"])
+  scheduler.add("knowledge", knowledge, inputs=["prepare"], timeout=STAGE_DEADLINES["knowledge"])
+  scheduler.add("crawl", crawl, inputs=["prepare", "results"])
+  scheduler.add("summary", summary, inputs=["prepare", "crawl"])
+  scheduler.add("follow_ups", follow_ups, inputs=["prepare", "results"])
+
+  # Stage completions and summary deltas, in the order they happen
+  updates: asyncio.Queue = asyncio.Queue()
+  initial_stages = ("results", "images", "knowledge")
+  initial = set(initial_stages)
+  remaining = {"summary", "follow_ups"}
+
+  watcher = None
+  try:
+    search = await scheduler.result("prepare")
+    yield "search", {
+      "thread_id": search.thread_id,
+      "query": search.query,
+      "search_type": search.search_type.value,
+      "featured_source": dict(search.featured_source) if search.featured_source else None,
+    }
+
+    watcher = asyncio.create_task(watch([*initial, *remaining]))
+    while initial or remaining:
+      stage, result = await updates.get()
+      if stage == "delta":
+        yield "delta", {"summary": result}
+        continue
+
+      initial.discard(stage)
+      remaining.discard(stage)
+      if stage == "results":
+        if search.search_type is SearchType.WEB:
+          yield "sources", {"sources": [source.dict() for source in search.sources], "location": search.location_used}
+        elif search.search_type is SearchType.PLACE and search.places:
+          yield "places", {"places": [place.dict() for place in search.places]}
+      elif stage == "images" and search.images:
+        yield "images", {"images": [image.dict() for image in search.images]}
+      elif stage == "knowledge" and result:
+        if thread.turn_count == 0:
+          search.knowledge_panel = result
+        elif thread.turn_count > 0:
+          if thread.history()[-1].knowledge_panel_label and thread.history()[-1].knowledge_panel_label != result['label']:
+            search.knowledge_panel = result
+          else:
+            search.knowledge_panel = result
+        yield "knowledge_panel", {"knowledge_panel": search.knowledge_panel}
+      elif stage == "follow_ups":
+        yield "follow_ups", {"follow_ups": search.follow_ups}
+
+      if stage in initial_stages and not initial:
+        search.logs.knowledge_panel_time = scheduler.timings.get("knowledge", 0)
+        search.logs.timed_out_stages = scheduler.timed_out
+        yield "ready", search
+  finally:
+    scheduler.cancel_all()
+    if watcher is not None:
+      watcher.cancel()
 
-  if search.search_type is SearchType.WEB:
-    async for word in summarise(search):
-      yield json.dumps({
-        "delta": {
-          "summary": word
-        }
-      }) + "\n"
-  
-  await background_task
-  
-  yield json.dumps({
-    "follow_ups": search.follow_ups
-  }) + "\n"
-  
   thread.add(search)
-  asyncio.create_task(thread.save())
-  
+  await thread.save_later()
+
+  yield "done", {"search_type": search.search_type.value, "warnings": search.warnings}
+
+async def quest_search(query: str, thread: Thread, ip: str, protocol: int = 1):
+  """
+  Streams a search as NDJSON.
+
+  With `protocol` 2 every part is sent as its own event the moment it is
+  ready (see `components.events`). Protocol 1 keeps the original response:
+  a single blob once sources, images and the knowledge panel are all in,
+  then the summary deltas and finally the follow-ups.
+  """
+  follow_ups = None
+  # Protocol 1 deltas that arrive before the blob is sent wait for it
+  held_deltas: Optional[List[str]] = []
+  async for event, data in search_events(query, thread, ip):
+    if protocol >= PROTOCOL_VERSION:
+      if event != "ready":
+        yield encode_event(event, data)
+    elif event == "ready":
+      # The summary and follow-ups may already be in, but protocol 1 sends them afterwards
+      yield data.copy(update={"summary": None, "follow_ups": []}).clientJSON() + "\n"
+      for delta in held_deltas:
+        yield delta
+      held_deltas = None
+    elif event == "delta":
+      line = json.dumps({"delta": data}) + "\n"
+      if held_deltas is None:
+        yield line
+      else:
+        held_deltas.append(line)
+    elif event == "follow_ups":
+      follow_ups = data
+    elif event == "done" and follow_ups is not None:
+      yield json.dumps(follow_ups) + "\n"
+
+def retarget_event(event: str, leader_thread_id: str, thread_id: str) -> str:
+  """
+  Rewrites the thread ID in a replayed event so it points at the subscriber's own thread
+  """
+  if leader_thread_id not in event:
+    return event
+  data = json.loads(event)
+  payload = data['data'] if 'event' in data else data
+  if payload.get('thread_id') != leader_thread_id:
+    return event
+  payload['thread_id'] = thread_id
+  return json.dumps(data) + "\n"
+
+async def coalesced_search(query: str, ip: str, protocol: int = 1):
+  """
+  Runs a context-free search, sharing the pipeline with an identical search
+  that is already in flight.
+
+  The first request runs `quest_search` in the background and publishes its
+  events. Duplicate requests that arrive while it runs replay the same events
+  (including every summary delta) and get a copy of the finished search saved
+  to their own thread.
+  """
+  try:
+    geolocation = await asyncio.wait_for(Geolocation.get(ip), timeout=STAGE_DEADLINES["geolocation"])
+  except Exception as e:
+    # Only the coalescing key depends on it, the pipeline looks the location up again
+    print(f"Error getting geolocation for coalescing: {e!r}")
+    geolocation = None
+  key = (normalize_query(query), geolocation.city if geolocation else None, protocol)
+
+  entry = _in_flight_searches.get(key)
+  if entry is None:
+    thread = Thread.create()
+    broadcast = StreamBroadcast(quest_search(query, thread, ip, protocol))
+    _in_flight_searches[key] = (broadcast, thread)
+    broadcast.task.add_done_callback(lambda _: _in_flight_searches.pop(key, None))
+
+    async for event in broadcast.subscribe():
+      yield event
+    return
+
+  broadcast, leader_thread = entry
+  thread = Thread.create()
+
+  async for event in broadcast.subscribe():
+    yield retarget_event(event, leader_thread.id, thread.id)
+
+  await broadcast.wait()
+
+  if len(leader_thread.searches) > 0:
+    thread.add(leader_thread.searches[-1].copy(update={"thread_id": thread.id}))
+    await thread.save_later()
+
 async def summarise_article(article_id: str):
   article = await Article.get(article_id)
   
@@ -135,6 +341,6 @@ async def summarise_article(article_id: str):
     
     user_thread.add(user_search)
     article_thread.add(article_search)
-    asyncio.create_task(user_thread.save())
-    asyncio.create_task(article_thread.save())
-    asyncio.create_task(article.link_to_thread(article_thread))
\ No newline at end of file
+    await user_thread.save_later()
+    await article_thread.save_later()
+    await article.link_to_thread(article_thread)
\ No newline at end of file
@@ -0,0 +1,188 @@
+import re
+from typing import Dict, List, Optional, Union
+from lxml import etree, html as lxml_html
+
+# Elements that never hold main content
+JUNK_TAGS = [
+  "script", "style", "noscript", "template", "header", "footer", "nav", "aside",
+  "form", "iframe", "svg", "canvas", "button", "select", "input", "object", "embed",
+]
+
+# Class/ID fragments that mark boilerplate blocks
+JUNK_PATTERN = re.compile(
+  r"(^|[\s_-])(ad|ads|advert|advertisement|promo|banner|ad-banner|cookie|consent|share|social|"
+  r"comment|comments|related|recommended|sidebar|newsletter|subscribe|popup|modal|breadcrumb|"
+  r"menu|footer|header|nav)([\s_-]|$)",
+  re.IGNORECASE
+)
+
+# Class/ID fragments that usually mark the article body
+CONTENT_PATTERN = re.compile(r"article|content|entry|main|post|story|body|text", re.IGNORECASE)
+
+BLOCK_TAGS = {"p", "pre", "blockquote", "li", "h1", "h2", "h3", "h4", "td", "dd"}
+HEADING_TAGS = {"h1", "h2", "h3", "h4"}
+
+MIN_PARAGRAPH_LENGTH = 25
+MAX_LINK_DENSITY = 0.5
+# Boilerplate-looking blocks with more text than this that aren't mostly links are kept
+MAX_JUNK_TEXT_LENGTH = 200
+
+WHITESPACE = re.compile(r"\s+")
+
+def _text(element) -> str:
+  return WHITESPACE.sub(" ", element.text_content()).strip()
+
+def _link_density(element, text_length: int) -> float:
+  if text_length == 0:
+    return 1.0
+  link_length = sum(len(_text(link)) for link in element.iter("a"))
+  return min(1.0, link_length / text_length)
+
+def _looks_like_junk(element) -> bool:
+  '''
+  Class or id reads as boilerplate and not as content. Page wrappers often
+  carry both, e.g. "content-area has-sidebar" or "post-body share-enabled".
+  '''
+  attributes = f"{element.get('class', '')} {element.get('id', '')}"
+  if not attributes.strip():
+    return False
+  return bool(JUNK_PATTERN.search(attributes)) and not CONTENT_PATTERN.search(attributes)
+
+def _is_junk(element) -> bool:
+  '''
+  A boilerplate-looking block that is also small or mostly links, so
+  dropping it can't take an article with it
+  '''
+  if not _looks_like_junk(element):
+    return False
+  text_length = len(_text(element))
+  return text_length <= MAX_JUNK_TEXT_LENGTH or _link_density(element, text_length) > MAX_LINK_DENSITY
+
+def _parse(document: Union[str, bytes], encoding: Optional[str] = None):
+  if isinstance(document, str):
+    document = document.encode("utf-8")
+    encoding = "utf-8"
+  parser = lxml_html.HTMLParser(encoding=encoding, remove_comments=True, remove_pis=True)
+  return lxml_html.document_fromstring(document, parser=parser)
+
+def _strip_junk_tags(root):
+  etree.strip_elements(root, *JUNK_TAGS, with_tail=False)
+
+def _clean(root, keep=None):
+  '''
+  Drops boilerplate blocks. `keep` (the best container) and its ancestors are never dropped.
+  '''
+  kept = set(keep.iterancestors()) | {keep} if keep is not None else set()
+  for element in list(root.iter("div", "section", "ul", "ol", "table", "span")):
+    if element in kept or element.getparent() is None:
+      continue
+    if _is_junk(element):
+      element.drop_tree()
+
+def _score_containers(root) -> Dict[object, float]:
+  '''
+  Readability-style scoring: every substantial paragraph adds to its parent
+  and, at half weight, its grandparent. Containers are then penalised by
+  their link density and rewarded when their class or id looks like content,
+  or penalised when it only looks like boilerplate.
+  '''
+  scores: Dict[object, float] = {}
+
+  for paragraph in root.iter("p", "pre", "blockquote", "td"):
+    text = _text(paragraph)
+    if len(text) < MIN_PARAGRAPH_LENGTH:
+      continue
+
+    score = 1 + text.count(",") + min(len(text) / 100, 3)
+
+    parent = paragraph.getparent()
+    if parent is None:
+      continue
+    scores[parent] = scores.get(parent, 0) + score
+
+    grandparent = parent.getparent()
+    if grandparent is not None:
+      scores[grandparent] = scores.get(grandparent, 0) + score / 2
+
+  for container in list(scores):
+    text_length = len(_text(container))
+    scores[container] *= 1 - _link_density(container, text_length)
+    attributes = f"{container.get('class', '')} {container.get('id', '')}"
+    if CONTENT_PATTERN.search(attributes):
+      scores[container] *= 1.25
+    elif JUNK_PATTERN.search(attributes):
+      scores[container] *= 0.5
+    if container.tag == "article" or container.tag == "main":
+      scores[container] *= 1.5
+
+  return scores
+
+def _has_block_ancestor(element, container) -> bool:
+  for ancestor in element.iterancestors():
+    if ancestor is container:
+      return False
+    if ancestor.tag in BLOCK_TAGS:
+      return True
+  return False
+
+def _paragraphs(container) -> List[str]:
+  paragraphs = []
+  seen = set()
+
+  for element in container.iter(*BLOCK_TAGS):
+    # Nested blocks (a <p> inside an <li>) are emitted once, by the outermost block
+    if _has_block_ancestor(element, container):
+      continue
+
+    text = _text(element)
+    if not text or text in seen:
+      continue
+
+    is_heading = element.tag in HEADING_TAGS
+    if not is_heading and len(text) < MIN_PARAGRAPH_LENGTH:
+      continue
+    if _link_density(element, len(text)) > MAX_LINK_DENSITY:
+      continue
+
+    seen.add(text)
+    paragraphs.append(text)
+
+  # Drop trailing headings that introduce nothing
+  while paragraphs and len(paragraphs[-1]) < MIN_PARAGRAPH_LENGTH:
+    paragraphs.pop()
+
+  return paragraphs
+
+def extract_main_content(document: Union[str, bytes], encoding: Optional[str] = None) -> Optional[str]:
+  '''
+  Extracts the main content of an HTML page as clean paragraphs separated by blank lines.
+
+  :param document: The HTML page, as text or raw bytes
+  :param encoding: Encoding of the raw bytes, if known from the response headers
+  :return: The main content, or None if the page has no readable text
+  '''
+  try:
+    root = _parse(document, encoding)
+  except (etree.ParserError, ValueError):
+    return None
+
+  _strip_junk_tags(root)
+
+  # Scored before cleaning, so the article's wrappers are known and kept
+  scores = _score_containers(root)
+  best = max(scores, key=scores.get) if scores else None
+  _clean(root, keep=best)
+
+  if best is not None:
+    paragraphs = _paragraphs(best)
+    if paragraphs:
+      return "\n\n".join(paragraphs)
+
+  # No dominant container, keep every paragraph that isn't mostly links
+  body = root.find("body")
+  paragraphs = _paragraphs(body if body is not None else root)
+  if paragraphs:
+    return "\n\n".join(paragraphs)
+
+  text = _text(root)
+  return text or None
@@ -0,0 +1,139 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import signal
+from typing import Optional, Union
+from bs4 import BeautifulSoup, Comment
+
+from ..components.config import EXTRACTION_CPU_TIME_LIMIT, EXTRACTION_EXECUTOR, EXTRACTION_MAX_QUEUE, EXTRACTION_PARSER, EXTRACTION_WORKERS
+from .content_extractor import extract_main_content
+
+class CPUTimeExceeded(Exception):
+  pass
+
+def extract_text_from_html(html: Union[str, bytes], encoding: Optional[str] = None) -> Optional[str]:
+  '''
+  Strips scripts, navigation, comments and ads from an HTML page and returns its visible text
+  '''
+  if isinstance(html, bytes):
+    soup = BeautifulSoup(html, 'html.parser', from_encoding=encoding)
+  else:
+    soup = BeautifulSoup(html, 'html.parser')
+
+  for tag in soup(['script', 'style', 'header', 'footer', 'nav', 'aside']):
+    tag.decompose()
+
+  for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+    comment.extract()
+
+  for tag in soup.find_all(['div', 'section'], {'class': ['advertisement', 'promo', 'ad-banner']}):
+    tag.decompose()
+
+  return soup.get_text(separator=' ', strip=True)
+
+def extract_document(html: Union[str, bytes], encoding: Optional[str] = None, parser: str = EXTRACTION_PARSER) -> Optional[str]:
+  '''
+  Extracts the readable text of a page with the configured parser
+  '''
+  if parser == "bs4":
+    return extract_text_from_html(html, encoding)
+  return extract_main_content(html, encoding)
+
+def _raise_cpu_time_exceeded(signum, frame):
+  raise CPUTimeExceeded()
+
+def _init_worker():
+  signal.signal(signal.SIGPROF, _raise_cpu_time_exceeded)
+
+def _warm_up() -> bool:
+  # Parsing a tiny page loads the parser in the worker before real documents arrive
+  extract_document("<html><body><p>Warm up</p></body></html>")
+  return True
+
+def _extract_with_cpu_limit(html: Union[str, bytes], encoding: Optional[str], cpu_time_limit: float) -> Optional[str]:
+  '''
+  Runs in a worker process. ITIMER_PROF counts CPU time used by the process,
+  so a pathological page is interrupted once it has burned through its budget.
+  '''
+  signal.setitimer(signal.ITIMER_PROF, cpu_time_limit)
+  try:
+    return extract_document(html, encoding)
+  except CPUTimeExceeded:
+    return None
+  finally:
+    signal.setitimer(signal.ITIMER_PROF, 0)
+
+_executor: Optional[Executor] = None
+_queued = 0
+
+def _get_executor() -> Executor:
+  global _executor
+  if _executor is None:
+    if EXTRACTION_EXECUTOR == "process":
+      _executor = ProcessPoolExecutor(
+        max_workers=EXTRACTION_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker
+      )
+    else:
+      _executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="extraction")
+  return _executor
+
+async def extract(html: Union[str, bytes], encoding: Optional[str] = None) -> Optional[str]:
+  '''
+  Extracts the text of a page in the extraction pool so the event loop only does I/O.
+  Raw bytes are decoded by the parser, using `encoding` when the response declared one.
+
+  Returns None without parsing when the pool already has EXTRACTION_MAX_QUEUE
+  documents queued or running, or when a document exceeds its CPU budget.
+  Thread workers can't be interrupted, so in thread mode the budget is
+  enforced as a wall-clock timeout on the caller's side only.
+  '''
+  global _queued
+  if _queued >= EXTRACTION_MAX_QUEUE:
+    print("Extraction queue is full, skipping document")
+    return None
+
+  _queued += 1
+  try:
+    loop = asyncio.get_running_loop()
+    if EXTRACTION_EXECUTOR == "process":
+      return await loop.run_in_executor(_get_executor(), _extract_with_cpu_limit, html, encoding, EXTRACTION_CPU_TIME_LIMIT)
+    future = loop.run_in_executor(_get_executor(), extract_document, html, encoding)
+    return await asyncio.wait_for(future, timeout=EXTRACTION_CPU_TIME_LIMIT)
+  except asyncio.TimeoutError:
+    return None
+  finally:
+    _queued -= 1
+
+def stats() -> dict:
+  return {
+    "executor": EXTRACTION_EXECUTOR,
+    "parser": EXTRACTION_PARSER,
+    "workers": EXTRACTION_WORKERS,
+    "queued": _queued,
+    "max_queue": EXTRACTION_MAX_QUEUE,
+  }
+
+async def startup():
+  '''
+  Creates the pool and, in process mode, starts every worker. Spawned workers
+  otherwise start on their first document, so the first crawls after a
+  deploy would pay the process start-up and imports inside their timeout.
+  '''
+  executor = _get_executor()
+  if EXTRACTION_EXECUTOR != "process":
+    return
+  loop = asyncio.get_running_loop()
+  try:
+    await asyncio.gather(*(loop.run_in_executor(executor, _warm_up) for _ in range(EXTRACTION_WORKERS)))
+  except Exception as e:
+    # A worker that died warming up breaks the pool, start over with a fresh one on first use
+    print(f"Error warming up extraction workers: {e}")
+    await shutdown()
+
+async def shutdown():
+  global _executor
+  if _executor is not None:
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
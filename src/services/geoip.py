@@ -0,0 +1,93 @@
+import asyncio
+from bisect import bisect_right
+import csv
+import gzip
+import ipaddress
+import os
+from typing import List, Optional
+
+from ..components.config import GEOIP_DATABASE_PATH
+
+GEOIP_FIELDS = ["country", "city", "latitude", "longitude", "zipcode"]
+
+class IPRangeDatabase:
+  '''
+  Offline IP range -> location table.
+
+  The source file is a CSV (optionally gzipped) with the columns
+  `start_ip,end_ip,country,city,latitude,longitude,zipcode`. Ranges are kept
+  in sorted arrays per IP version so lookups are a binary search.
+  '''
+  def __init__(self):
+    self._starts = {4: [], 6: []}
+    self._ends = {4: [], 6: []}
+    self._rows = {4: [], 6: []}
+
+  def __len__(self) -> int:
+    return len(self._rows[4]) + len(self._rows[6])
+
+  @classmethod
+  def load(cls, path: str) -> "IPRangeDatabase":
+    database = cls()
+    ranges = {4: [], 6: []}
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="", encoding="utf-8") as file:
+      for row in csv.reader(file):
+        if len(row) < 2 or row[0].startswith("#") or row[0] == "start_ip":
+          continue
+        try:
+          start = ipaddress.ip_address(row[0].strip())
+          end = ipaddress.ip_address(row[1].strip())
+        except ValueError:
+          continue
+        if start.version != end.version:
+          continue
+        values = [value.strip() or None for value in row[2:2 + len(GEOIP_FIELDS)]]
+        values += [None] * (len(GEOIP_FIELDS) - len(values))
+        ranges[start.version].append((int(start), int(end), tuple(values)))
+
+    for version, rows in ranges.items():
+      rows.sort(key=lambda r: r[0])
+      database._starts[version] = [r[0] for r in rows]
+      database._ends[version] = [r[1] for r in rows]
+      database._rows[version] = [r[2] for r in rows]
+
+    return database
+
+  def lookup(self, ip: str) -> Optional[dict]:
+    try:
+      address = ipaddress.ip_address(ip)
+    except ValueError:
+      return None
+
+    value = int(address)
+    starts: List[int] = self._starts[address.version]
+    index = bisect_right(starts, value) - 1
+    if index < 0 or value > self._ends[address.version][index]:
+      return None
+
+    return dict(zip(GEOIP_FIELDS, self._rows[address.version][index]))
+
+_database: Optional[IPRangeDatabase] = None
+
+async def load_database():
+  '''
+  Loads the offline database configured by GEOIP_DATABASE_PATH, if any
+  '''
+  global _database
+  if not GEOIP_DATABASE_PATH:
+    return
+  if not os.path.exists(GEOIP_DATABASE_PATH):
+    print(f"GeoIP database not found at {GEOIP_DATABASE_PATH}")
+    return
+  try:
+    _database = await asyncio.to_thread(IPRangeDatabase.load, GEOIP_DATABASE_PATH)
+    print(f"Loaded {len(_database)} GeoIP ranges")
+  except Exception as e:
+    print(f"Error loading GeoIP database: {e}")
+
+def lookup(ip: str) -> Optional[dict]:
+  if _database is None:
+    return None
+  return _database.lookup(ip)
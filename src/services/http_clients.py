@@ -0,0 +1,249 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import time
+from typing import Deque, Dict, Optional
+import httpx
+
+from ..components.config import HEDGE_MIN_SAMPLES, HEDGE_PERCENTILE, HEDGE_WINDOW
+from .resilience import AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable, is_failure
+
+try:
+  import h2  # Optional - enables HTTP/2 on upstreams that support it
+  HTTP2_AVAILABLE = True
+except ImportError:
+  HTTP2_AVAILABLE = False
+
+@dataclass
+class Upstream:
+  '''
+  Connection settings for a single upstream API
+  '''
+  name: str
+  timeout: float = 5.0
+  connect_timeout: float = 2.0
+  max_connections: int = 50
+  max_keepalive_connections: int = 20
+  keepalive_expiry: float = 30.0
+  http2: bool = True
+  follow_redirects: bool = False
+  hedge: bool = False  # Send a duplicate GET once a request is slower than the rolling p95
+  latency_target: float = 1.0  # Responses slower than this shrink the adaptive concurrency limit
+
+UPSTREAMS: Dict[str, Upstream] = {
+  upstream.name: upstream for upstream in [
+    Upstream(name="brave", timeout=5.0, max_connections=100, max_keepalive_connections=40, hedge=True, latency_target=1.0),
+    # Yelp has a small daily quota, so its requests are never duplicated
+    Upstream(name="yelp", timeout=5.0, max_connections=50, max_keepalive_connections=20, latency_target=1.5),
+    Upstream(name="wikidata", timeout=5.0, max_connections=50, max_keepalive_connections=20, hedge=True, latency_target=1.0),
+    Upstream(name="wikidata_sparql", timeout=8.0, max_connections=30, max_keepalive_connections=10, hedge=True, latency_target=2.0),
+    Upstream(name="ipgeolocation", timeout=3.0, max_connections=50, max_keepalive_connections=20, hedge=True, latency_target=0.5),
+    Upstream(name="openweather", timeout=3.0, max_connections=20, max_keepalive_connections=10),
+    # Crawled pages live on arbitrary hosts, so keep-alive helps less but the pool still bounds fan-out
+    Upstream(name="crawler", timeout=1.5, connect_timeout=1.0, max_connections=200, max_keepalive_connections=50, keepalive_expiry=15.0),
+  ]
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+def _build_client(upstream: Upstream) -> httpx.AsyncClient:
+  return httpx.AsyncClient(
+    http2=upstream.http2 and HTTP2_AVAILABLE,
+    follow_redirects=upstream.follow_redirects,
+    timeout=httpx.Timeout(upstream.timeout, connect=upstream.connect_timeout),
+    limits=httpx.Limits(
+      max_connections=upstream.max_connections,
+      max_keepalive_connections=upstream.max_keepalive_connections,
+      keepalive_expiry=upstream.keepalive_expiry
+    )
+  )
+
+def get_client(name: str) -> httpx.AsyncClient:
+  '''
+  Returns the pooled client for the given upstream.
+
+  Clients are created at application startup. Scripts that run outside of the
+  FastAPI lifecycle get a lazily created client instead.
+  '''
+  client = _clients.get(name)
+  if client is None or client.is_closed:
+    upstream = UPSTREAMS.get(name)
+    if upstream is None:
+      raise KeyError(f"Unknown upstream: {name}")
+    client = _build_client(upstream)
+    _clients[name] = client
+  return client
+
+class LatencyTracker:
+  '''
+  Rolling window of recent response times for one upstream
+  '''
+  def __init__(self, window: int = HEDGE_WINDOW):
+    self.samples: Deque[float] = deque(maxlen=window)
+    self.hedged = 0
+    self.hedge_wins = 0
+
+  def record(self, latency: float):
+    self.samples.append(latency)
+
+  def percentile(self, percentile: float = HEDGE_PERCENTILE) -> Optional[float]:
+    if len(self.samples) < HEDGE_MIN_SAMPLES:
+      return None
+    ordered = sorted(self.samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+  def stats(self) -> dict:
+    return {
+      "samples": len(self.samples),
+      "p95": self.percentile(),
+      "hedged": self.hedged,
+      "hedge_wins": self.hedge_wins,
+    }
+
+_latencies: Dict[str, LatencyTracker] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+  tracker = _latencies.get(name)
+  if tracker is None:
+    tracker = _latencies[name] = LatencyTracker()
+  return tracker
+
+def get_breaker(name: str) -> CircuitBreaker:
+  breaker = _breakers.get(name)
+  if breaker is None:
+    breaker = _breakers[name] = CircuitBreaker()
+  return breaker
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+  limiter = _limiters.get(name)
+  if limiter is None:
+    upstream = UPSTREAMS.get(name) or Upstream(name=name)
+    limiter = _limiters[name] = AdaptiveLimiter(
+      initial_limit=upstream.max_connections,
+      # A floor, so an upstream that is slow as usual keeps useful concurrency
+      min_limit=max(1, upstream.max_connections // 4),
+      max_limit=upstream.max_connections,
+      latency_target=upstream.latency_target
+    )
+  return limiter
+
+def is_available(name: str) -> bool:
+  '''
+  False while the upstream's circuit breaker is open, so callers can skip it up front
+  '''
+  return get_breaker(name).state != CircuitBreaker.OPEN
+
+async def _timed_get(name: str, url: str, **kwargs) -> httpx.Response:
+  '''
+  Sends a GET through the upstream's circuit breaker and adaptive concurrency limit
+  '''
+  breaker = get_breaker(name)
+  limiter = get_limiter(name)
+
+  if not breaker.allow():
+    raise UpstreamUnavailable(f"Circuit breaker for {name} is open")
+  try:
+    acquired = await limiter.acquire()
+  except asyncio.CancelledError:
+    breaker.record_cancelled()
+    raise
+  if not acquired:
+    breaker.record_cancelled()
+    raise UpstreamUnavailable(f"Concurrency limit for {name} reached")
+
+  start_time = time.time()
+  try:
+    response = await get_client(name).get(url, **kwargs)
+  except asyncio.CancelledError:
+    limiter.cancel()
+    breaker.record_cancelled()
+    raise
+  except Exception:
+    limiter.release(time.time() - start_time, ok=False)
+    breaker.record_failure()
+    raise
+
+  latency = time.time() - start_time
+  ok = not is_failure(response)
+  limiter.release(latency, ok=ok)
+  if ok:
+    breaker.record_success()
+  else:
+    breaker.record_failure()
+  get_latency_tracker(name).record(latency)
+  return response
+
+async def hedged_get(name: str, url: str, **kwargs) -> httpx.Response:
+  '''
+  Sends an idempotent GET to an upstream.
+
+  For upstreams with hedging enabled, a duplicate request is sent once the
+  first has been outstanding for longer than the upstream's rolling p95, and
+  whichever response arrives first wins. The slower request is cancelled.
+  Until enough samples are collected requests are sent once.
+
+  Every attempt goes through the upstream's circuit breaker and concurrency
+  limit and raises UpstreamUnavailable when either turns it away.
+  '''
+  upstream = UPSTREAMS.get(name)
+  tracker = get_latency_tracker(name)
+  hedge_after = tracker.percentile() if upstream and upstream.hedge else None
+
+  if hedge_after is None:
+    return await _timed_get(name, url, **kwargs)
+
+  primary = asyncio.create_task(_timed_get(name, url, **kwargs))
+  pending = {primary}
+  # Requests still running when the caller is cancelled (e.g. by a stage deadline) are cancelled too
+  try:
+    done, pending = await asyncio.wait(pending, timeout=hedge_after)
+    if done:
+      return primary.result()
+
+    tracker.hedged += 1
+    hedge = asyncio.create_task(_timed_get(name, url, **kwargs))
+    pending = {primary, hedge}
+    while pending:
+      done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+      succeeded = [task for task in done if task.exception() is None]
+      if succeeded:
+        if primary not in succeeded:
+          tracker.hedge_wins += 1
+        return succeeded[0].result()
+    # Both requests failed, surface the original error
+    return primary.result()
+  finally:
+    for task in pending:
+      task.cancel()
+
+def stats() -> dict:
+  names = set(_latencies) | set(_breakers) | set(_limiters)
+  return {
+    name: {
+      "latency": get_latency_tracker(name).stats(),
+      "breaker": get_breaker(name).stats(),
+      "concurrency": get_limiter(name).stats(),
+    }
+    for name in sorted(names)
+  }
+
+async def startup():
+  '''
+  Opens one connection pool per upstream
+  '''
+  for name in UPSTREAMS:
+    get_client(name)
+  print(f"Opened HTTP clients for {len(_clients)} upstreams (HTTP/2 {'enabled' if HTTP2_AVAILABLE else 'unavailable'})")
+
+async def shutdown():
+  '''
+  Closes all upstream connection pools
+  '''
+  for name, client in list(_clients.items()):
+    try:
+      await client.aclose()
+    except Exception as e:
+      print(f"Error closing HTTP client for {name}: {e}")
+  _clients.clear()
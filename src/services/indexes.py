@@ -0,0 +1,68 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from .database import mongo_client
+
+@dataclass
+class Index:
+  '''
+  An index the app's queries rely on
+  '''
+  collection: str
+  keys: List[Tuple[str, int]]
+  options: dict = field(default_factory=dict)
+
+  @property
+  def name(self) -> str:
+    # Mongo's default name, so indexes created before this list existed are recognised
+    return "_".join(f"{key}_{direction}" for key, direction in self.keys)
+
+  def model(self) -> IndexModel:
+    return IndexModel(self.keys, **self.options)
+
+INDEXES: List[Index] = [
+  # Thread.get, the thread view pipeline and the version-guarded appends of Thread.save
+  Index("threads", [("id", ASCENDING)], {"unique": True}),
+  # Article.get and Article.link_to_thread
+  Index("articles", [("id", ASCENDING)], {"unique": True}),
+  # Article.gnews_exists, and keeps the crawler from saving the same story twice
+  Index("articles", [("og_url", ASCENDING)], {"unique": True}),
+  # The news feed: latest articles in a topic
+  Index("articles", [("topic", ASCENDING), ("publish_date", DESCENDING)]),
+  # Hard expiry of TieredCache entries, lookups themselves go by _id
+  Index("knowledge_panels", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+  Index("crawled_pages", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+]
+
+async def ensure_collection_indexes(collection: str, indexes: List[Index]) -> Dict[str, bool]:
+  created = {}
+  for index in indexes:
+    try:
+      # A no-op when an identical index already exists
+      await mongo_client.quest[collection].create_indexes([index.model()])
+      created[index.name] = True
+    except OperationFailure as e:
+      # e.g. an index on the same keys with other options, or duplicates under a unique index
+      print(f"Error creating index {index.name} on {collection}: {e}")
+      created[index.name] = False
+  return created
+
+async def ensure_indexes() -> Dict[str, Dict[str, bool]]:
+  '''
+  Creates every declared index that doesn't exist yet. Safe to run on every
+  startup. Failures are logged and don't stop the app, so run
+  `scripts/check_query_plans.py` to see whether the queries are covered.
+  '''
+  by_collection: Dict[str, List[Index]] = {}
+  for index in INDEXES:
+    by_collection.setdefault(index.collection, []).append(index)
+
+  try:
+    results = await asyncio.gather(*(ensure_collection_indexes(name, indexes) for name, indexes in by_collection.items()))
+  except Exception as e:
+    print(f"Error creating indexes: {e}")
+    return {}
+  return dict(zip(by_collection, results))
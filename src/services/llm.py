@@ -0,0 +1,219 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import random
+import time
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+import httpx
+from openai import AsyncOpenAI
+from groq import AsyncGroq
+
+from ..components.keys import GROQ_API_KEY, OPENAI_API_KEY
+from ..components.config import (
+  GROQ_MAX_CONCURRENCY, LLM_ACQUIRE_TIMEOUT, LLM_BACKOFF_BASE, LLM_BACKOFF_CAP, LLM_CALL_DEADLINE, LLM_FAILOVER_ERROR_RATE,
+  LLM_FAILOVER_LATENCY, LLM_HEALTH_MIN_SAMPLES, LLM_HEALTH_WINDOW, LLM_MAX_ATTEMPTS, LLM_REQUEST_TIMEOUT,
+  OPENAI_MAX_CONCURRENCY
+)
+
+T = TypeVar("T")
+
+class ProviderBusy(Exception):
+  '''
+  Raised when no slot frees up on a provider within the acquire timeout
+  '''
+  pass
+
+class LLMProvider:
+  '''
+  A process-wide LLM client with a concurrency cap.
+
+  The underlying SDK client (and its connection pool) is created once and
+  reused for every call, including retries.
+  '''
+  def __init__(self, name: str, factory: Callable[[httpx.AsyncClient], object], max_concurrency: int):
+    self.name = name
+    self.max_concurrency = max_concurrency
+    self._factory = factory
+    self._client = None
+    self._semaphore = asyncio.Semaphore(max_concurrency)
+    self.in_flight = 0
+    self.waiting = 0
+    self.calls = 0
+    self.errors = 0
+    # (latency, succeeded) of recent calls made through `call_with_policy`
+    self._outcomes: Deque[Tuple[float, bool]] = deque(maxlen=LLM_HEALTH_WINDOW)
+
+  @property
+  def client(self):
+    if self._client is None:
+      http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=5.0),
+        limits=httpx.Limits(
+          max_connections=self.max_concurrency,
+          max_keepalive_connections=self.max_concurrency,
+          keepalive_expiry=60.0
+        )
+      )
+      self._client = self._factory(http_client)
+    return self._client
+
+  @asynccontextmanager
+  async def acquire(self, timeout: Optional[float] = None):
+    '''
+    Waits for a free slot and yields the shared client. Raises ProviderBusy
+    if none frees up within `timeout` seconds.
+
+    Streaming callers should consume the whole stream inside the block so the
+    slot is held for as long as the connection is in use.
+    '''
+    self.waiting += 1
+    try:
+      await asyncio.wait_for(self._semaphore.acquire(), timeout=timeout)
+    except asyncio.TimeoutError:
+      raise ProviderBusy(f"No free {self.name} slot within {timeout}s")
+    finally:
+      self.waiting -= 1
+
+    self.in_flight += 1
+    self.calls += 1
+    try:
+      yield self.client
+    except BaseException:
+      self.errors += 1
+      raise
+    finally:
+      self.in_flight -= 1
+      self._semaphore.release()
+
+  def record(self, latency: float, succeeded: bool):
+    self._outcomes.append((latency, succeeded))
+
+  def error_rate(self) -> float:
+    if not self._outcomes:
+      return 0.0
+    return sum(1 for _, succeeded in self._outcomes if not succeeded) / len(self._outcomes)
+
+  def p95_latency(self) -> Optional[float]:
+    latencies = sorted(latency for latency, _ in self._outcomes)
+    if not latencies:
+      return None
+    return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+  @property
+  def degraded(self) -> bool:
+    '''
+    True when recent calls were too slow or failed too often to be the first choice
+    '''
+    if len(self._outcomes) < LLM_HEALTH_MIN_SAMPLES:
+      return False
+    return self.error_rate() > LLM_FAILOVER_ERROR_RATE or self.p95_latency() > LLM_FAILOVER_LATENCY
+
+  def stats(self) -> dict:
+    return {
+      "max_concurrency": self.max_concurrency,
+      "in_flight": self.in_flight,
+      "waiting": self.waiting,
+      "calls": self.calls,
+      "errors": self.errors,
+      "connected": self._client is not None,
+      "error_rate": self.error_rate(),
+      "p95_latency": self.p95_latency(),
+      "degraded": self.degraded,
+    }
+
+  async def close(self):
+    if self._client is not None:
+      await self._client.close()
+      self._client = None
+
+_providers: Dict[str, LLMProvider] = {
+  "openai": LLMProvider(
+    "openai",
+    lambda http_client: AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client),
+    OPENAI_MAX_CONCURRENCY
+  ),
+  "groq": LLMProvider(
+    "groq",
+    lambda http_client: AsyncGroq(api_key=GROQ_API_KEY, http_client=http_client),
+    GROQ_MAX_CONCURRENCY
+  ),
+}
+
+def get_provider(name: str) -> LLMProvider:
+  provider: Optional[LLMProvider] = _providers.get(name)
+  if provider is None:
+    raise KeyError(f"Unknown LLM provider: {name}")
+  return provider
+
+def acquire(name: str):
+  '''
+  Shortcut for `get_provider(name).acquire()`
+  '''
+  return get_provider(name).acquire()
+
+def backoff_delay(attempt: int) -> float:
+  '''
+  Exponential backoff with full jitter for the given retry (starting at 1)
+  '''
+  return random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+async def call_with_policy(
+  call: Callable[[object, str], Awaitable[T]],
+  models: Dict[str, str],
+  deadline: float = LLM_CALL_DEADLINE,
+  max_attempts: int = LLM_MAX_ATTEMPTS
+) -> T:
+  '''
+  Runs `call(client, model)` against the given providers until it succeeds.
+
+  `models` maps provider names to the model to use with each, in order of
+  preference. Degraded providers (see `LLMProvider.degraded`) move to the
+  back, and retries alternate between providers, so a failing provider
+  fails over on the first retry. Retries back off exponentially with jitter
+  and every attempt is bounded by what is left of `deadline` seconds.
+  Anything `call` raises counts as a failure, including parse errors, and
+  so does waiting longer than LLM_ACQUIRE_TIMEOUT for a slot on a provider
+  whose slots are all taken (e.g. by summary streams).
+
+  Raises the last error once the attempts or the deadline run out.
+  '''
+  started_at = time.time()
+  providers = sorted(models, key=lambda name: get_provider(name).degraded)
+  last_error: Optional[BaseException] = None
+
+  for attempt in range(max_attempts):
+    if attempt > 0:
+      delay = backoff_delay(attempt)
+      if time.time() + delay >= started_at + deadline:
+        break
+      await asyncio.sleep(delay)
+
+    remaining = started_at + deadline - time.time()
+    if remaining <= 0:
+      break
+
+    name = providers[attempt % len(providers)]
+    provider = get_provider(name)
+    attempt_started_at = time.time()
+    try:
+      async with provider.acquire(timeout=min(remaining, LLM_ACQUIRE_TIMEOUT)) as client:
+        remaining = started_at + deadline - time.time()
+        result = await asyncio.wait_for(call(client, models[name]), timeout=remaining)
+      provider.record(time.time() - attempt_started_at, True)
+      return result
+    except Exception as e:
+      provider.record(time.time() - attempt_started_at, False)
+      print(f"LLM call to {name} failed (attempt {attempt + 1}): {e!r}")
+      last_error = e
+
+  raise last_error or asyncio.TimeoutError(f"LLM call did not finish within {deadline}s")
+
+def stats() -> dict:
+  return {name: provider.stats() for name, provider in _providers.items()}
+
+async def shutdown():
+  for name, provider in _providers.items():
+    try:
+      await provider.close()
+    except Exception as e:
+      print(f"Error closing LLM client for {name}: {e}")
@@ -0,0 +1,200 @@
+import asyncio
+from collections import deque
+import time
+from typing import Deque
+import httpx
+
+from ..components.config import (
+  BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, LIMIT_BACKOFF, LIMIT_CONGESTED_SHARE, LIMIT_MAX_QUEUE,
+  LIMIT_MIN_WINDOW, LIMIT_QUEUE_TIMEOUT
+)
+
+class UpstreamUnavailable(httpx.RequestError):
+  '''
+  Raised instead of sending a request when an upstream's circuit breaker is
+  open or its concurrency limit is reached. It is a RequestError, so callers
+  that already handle network failures handle it the same way.
+  '''
+  pass
+
+class CircuitBreaker:
+  '''
+  Stops traffic to an upstream after consecutive failures.
+
+  Once open, requests fail fast for `reset_timeout` seconds. After that the
+  breaker is half-open and lets a single probe through: a success closes it,
+  a failure opens it again.
+  '''
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half_open"
+
+  def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.failures = 0
+    self.opened_at = None
+    self.probing = False
+    self.rejected = 0
+
+  @property
+  def state(self) -> str:
+    if self.opened_at is None:
+      return self.CLOSED
+    if time.time() - self.opened_at >= self.reset_timeout:
+      return self.HALF_OPEN
+    return self.OPEN
+
+  def allow(self) -> bool:
+    state = self.state
+    if state == self.CLOSED:
+      return True
+    if state == self.HALF_OPEN and not self.probing:
+      self.probing = True
+      return True
+    self.rejected += 1
+    return False
+
+  def record_success(self):
+    self.failures = 0
+    self.opened_at = None
+    self.probing = False
+
+  def record_failure(self):
+    self.failures += 1
+    if self.probing or self.failures >= self.failure_threshold:
+      self.opened_at = time.time()
+    self.probing = False
+
+  def record_cancelled(self):
+    # A cancelled probe (e.g. the losing side of a hedge) says nothing about the upstream
+    self.probing = False
+
+  def stats(self) -> dict:
+    return {
+      "state": self.state,
+      "failures": self.failures,
+      "rejected": self.rejected,
+    }
+
+class AdaptiveLimiter:
+  '''
+  AIMD concurrency limit for an upstream.
+
+  Responses are judged per window of `latency_target` seconds (at least
+  LIMIT_MIN_WINDOW). When a window closes with at least LIMIT_CONGESTED_SHARE
+  of its responses slow or failed, the limit is multiplied by LIMIT_BACKOFF,
+  so it drops at most once per window however many requests were caught
+  in the slowdown. Every fast success while the limit is in use raises it
+  by one, which recovers from a brownout within a few windows of traffic.
+
+  Requests over the limit wait up to LIMIT_QUEUE_TIMEOUT for a slot, with at
+  most LIMIT_MAX_QUEUE waiting, and are rejected after that. This keeps
+  memory bounded when an upstream slows down.
+  '''
+  def __init__(
+    self,
+    initial_limit: int,
+    min_limit: int,
+    max_limit: int,
+    latency_target: float,
+    backoff: float = LIMIT_BACKOFF,
+    max_queue: int = LIMIT_MAX_QUEUE
+  ):
+    self.limit = float(initial_limit)
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.latency_target = latency_target
+    self.backoff = backoff
+    self.max_queue = max_queue
+    self.window = max(latency_target, LIMIT_MIN_WINDOW)
+    self.in_flight = 0
+    self.rejected = 0
+    self.queued = 0
+    self.decreases = 0
+    self._waiters: Deque[asyncio.Future] = deque()
+    self._window_started_at = time.time()
+    self._window_responses = 0
+    self._window_congested = 0
+
+  def try_acquire(self) -> bool:
+    if self.in_flight >= int(self.limit) or self._waiters:
+      return False
+    self.in_flight += 1
+    return True
+
+  async def acquire(self, timeout: float = LIMIT_QUEUE_TIMEOUT) -> bool:
+    '''
+    Takes a slot, waiting up to `timeout` seconds in line for one. False when rejected.
+    '''
+    if self.try_acquire():
+      return True
+    if len(self._waiters) >= self.max_queue or timeout <= 0:
+      self.rejected += 1
+      return False
+
+    waiter = asyncio.get_running_loop().create_future()
+    self._waiters.append(waiter)
+    self.queued += 1
+    try:
+      await asyncio.wait_for(waiter, timeout=timeout)
+      return True
+    except asyncio.TimeoutError:
+      self.rejected += 1
+      return False
+    except asyncio.CancelledError:
+      if waiter.done() and not waiter.cancelled():
+        # The slot was handed over just as the caller was cancelled
+        self.cancel()
+      raise
+    finally:
+      if waiter in self._waiters:
+        self._waiters.remove(waiter)
+
+  def _wake(self):
+    # Slots go to waiters in order, each one taken on their behalf
+    while self._waiters and self.in_flight < int(self.limit):
+      waiter = self._waiters.popleft()
+      if waiter.done():
+        continue
+      self.in_flight += 1
+      waiter.set_result(True)
+
+  def release(self, latency: float, ok: bool):
+    self.in_flight -= 1
+    congested = not ok or latency > self.latency_target
+    self._window_responses += 1
+    self._window_congested += congested
+
+    now = time.time()
+    if now - self._window_started_at >= self.window:
+      if self._window_congested >= self._window_responses * LIMIT_CONGESTED_SHARE:
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self.decreases += 1
+      self._window_started_at = now
+      self._window_responses = 0
+      self._window_congested = 0
+    elif not congested and self.in_flight + 1 >= self.limit / 2:
+      # Only grow while the limit is actually in use
+      self.limit = min(float(self.max_limit), self.limit + 1)
+    self._wake()
+
+  def cancel(self):
+    self.in_flight -= 1
+    self._wake()
+
+  def stats(self) -> dict:
+    return {
+      "limit": int(self.limit),
+      "in_flight": self.in_flight,
+      "waiting": len(self._waiters),
+      "queued": self.queued,
+      "rejected": self.rejected,
+      "decreases": self.decreases,
+    }
+
+def is_failure(response: httpx.Response) -> bool:
+  '''
+  Server errors and rate limiting count against an upstream, other client errors don't
+  '''
+  return response.status_code >= 500 or response.status_code == 429
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Hashable, Optional
+import time
+
+from ..components.cache import TTLCache
+from .database import mongo_client
+from . import write_queue
+
+class TieredEntry:
+  __slots__ = ("value", "fresh_until", "meta")
+
+  def __init__(self, value: Any, fresh_until: float, meta: Optional[dict] = None):
+    self.value = value
+    self.fresh_until = fresh_until
+    self.meta = meta or {}
+
+  @property
+  def is_fresh(self) -> bool:
+    return time.time() < self.fresh_until
+
+class TieredCache:
+  '''
+  Two-tier cache: an in-process LRU in front of a Mongo collection.
+
+  Every entry has a freshness window, after which callers may serve it as
+  stale while they refresh it, and a hard expiry enforced by a TTL index on
+  `expires_at` in Mongo (declared in services/indexes.py) and by the LRU's
+  own TTL in process.
+  '''
+  def __init__(self, collection: str, max_size: int, max_age: float):
+    self.collection = collection
+    self.max_age = max_age
+    self._local = TTLCache(max_size=max_size, ttl=max_age)
+
+  @property
+  def _collection(self):
+    return mongo_client.quest[self.collection]
+
+  async def get(self, key: Hashable) -> Optional[TieredEntry]:
+    entry = self._local.get_entry(key)
+    if entry is not None and not entry.is_expired():
+      self._local.hits += 1
+      return entry.value
+    self._local.misses += 1
+
+    try:
+      doc = await self._collection.find_one({"_id": key})
+    except Exception as e:
+      print(f"Error reading {self.collection} cache: {e}")
+      return None
+
+    if not doc:
+      return None
+
+    expires_at = doc.get("expires_at")
+    if expires_at is not None:
+      if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+      remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+      if remaining <= 0:
+        return None
+    else:
+      remaining = None
+
+    tiered = TieredEntry(doc.get("value"), doc.get("fresh_until", 0), doc.get("meta"))
+    self._local.set(key, tiered, ttl=remaining)
+    return tiered
+
+  def set(self, key: Hashable, value: Any, fresh_for: float, meta: Optional[dict] = None, max_age: Optional[float] = None):
+    '''
+    Stores the value in process immediately and queues the write to Mongo.
+    The write is skipped when the write queue is full.
+    '''
+    max_age = self.max_age if max_age is None else max_age
+    tiered = TieredEntry(value, time.time() + fresh_for, meta)
+    self._local.set(key, tiered, ttl=max_age)
+
+    doc = {
+      "_id": key,
+      "value": value,
+      "fresh_until": tiered.fresh_until,
+      "meta": tiered.meta,
+      "expires_at": datetime.now(timezone.utc) + timedelta(seconds=max_age),
+    }
+    write_queue.offer_replace(self.collection, key, {"_id": key}, doc)
+    return tiered
+
+  def stats(self) -> dict:
+    return self._local.stats()
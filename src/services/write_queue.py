@@ -0,0 +1,381 @@
+import asyncio
+from dataclasses import dataclass
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..components.config import (
+  WRITE_QUEUE_BATCH_SIZE, WRITE_QUEUE_DRAIN_TIMEOUT, WRITE_QUEUE_FLUSH_INTERVAL,
+  WRITE_QUEUE_MAX_PENDING, WRITE_QUEUE_MAX_RETRIES
+)
+from .database import mongo_client
+
+MERGEABLE_OPERATORS = {"$set", "$inc", "$push"}
+
+@dataclass
+class PendingWrite:
+  '''
+  A queued write to a single document: an update, a replacement, or a job.
+
+  Jobs are coroutines that do their own writing, for writes that need the
+  result of their operation (like version-guarded thread saves). They are
+  run individually instead of going into a bulk write.
+  '''
+  collection: str
+  filter: Optional[dict] = None
+  update: Optional[dict] = None
+  replacement: Optional[dict] = None
+  upsert: bool = False
+  job: Optional[Callable[[], Awaitable[Any]]] = None
+  owner: Any = None
+  attempts: int = 0
+
+  def operation(self):
+    if self.replacement is not None:
+      return ReplaceOne(self.filter, self.replacement, upsert=self.upsert)
+    return UpdateOne(self.filter, self.update, upsert=self.upsert)
+
+def _push_values(value: Any) -> Optional[list]:
+  if isinstance(value, dict):
+    if set(value) != {"$each"}:
+      return None
+    return list(value["$each"])
+  return [value]
+
+def merge_updates(older: dict, newer: dict) -> Optional[dict]:
+  '''
+  Combines two update documents for the same document into one with the
+  same effect, or returns None when they can't be combined.
+  '''
+  if not (set(older) | set(newer)) <= MERGEABLE_OPERATORS:
+    return None
+
+  merged = {operator: dict(fields) for operator, fields in older.items()}
+  for operator, fields in newer.items():
+    target = merged.setdefault(operator, {})
+    for name, value in fields.items():
+      if operator == "$set" or name not in target:
+        target[name] = value
+      elif operator == "$inc":
+        target[name] += value
+      else:
+        existing, added = _push_values(target[name]), _push_values(value)
+        if existing is None or added is None:
+          return None
+        target[name] = {"$each": existing + added}
+
+  # Mongo rejects updates that touch the same field with two operators
+  seen = set()
+  for fields in merged.values():
+    if seen & set(fields):
+      return None
+    seen |= set(fields)
+  return merged
+
+def combine(older: PendingWrite, newer: PendingWrite) -> Optional[PendingWrite]:
+  '''
+  Coalesces two pending writes to the same document, or returns None when
+  both have to be applied in order.
+  '''
+  if older.job or newer.job:
+    # A later save of the same object writes everything the earlier one would have
+    if older.job and newer.job and older.owner is newer.owner:
+      return newer
+    return None
+
+  if older.filter != newer.filter:
+    return None
+
+  attempts = max(older.attempts, newer.attempts)
+
+  if newer.replacement is not None:
+    return PendingWrite(older.collection, newer.filter, replacement=newer.replacement, upsert=newer.upsert, attempts=attempts)
+
+  if older.replacement is not None:
+    fields = newer.update.get("$set")
+    if set(newer.update) != {"$set"} or any("." in name for name in fields):
+      return None
+    return PendingWrite(older.collection, older.filter, replacement={**older.replacement, **fields}, upsert=older.upsert, attempts=attempts)
+
+  update = merge_updates(older.update, newer.update)
+  if update is None:
+    return None
+  return PendingWrite(older.collection, older.filter, update=update, upsert=older.upsert or newer.upsert, attempts=attempts)
+
+Key = Tuple[str, Hashable]
+
+class WriteBehindQueue:
+  '''
+  Bounded queue of Mongo writes, flushed in the background.
+
+  Writes are keyed by collection and document. A new write to a document
+  that already has one queued is merged into it where possible, so a
+  document is usually written once per flush. Writes are flushed with one
+  `bulk_write` per collection once `batch_size` are queued or
+  `flush_interval` after the first one arrived.
+
+  When `max_pending` writes are queued, `put` waits for the next flush
+  (backpressure) and `offer` drops the write, for best-effort writes such
+  as cache entries. Failed batches are retried up to `max_retries` times.
+  '''
+  def __init__(
+    self,
+    max_pending: int = WRITE_QUEUE_MAX_PENDING,
+    batch_size: int = WRITE_QUEUE_BATCH_SIZE,
+    flush_interval: float = WRITE_QUEUE_FLUSH_INTERVAL,
+    max_retries: int = WRITE_QUEUE_MAX_RETRIES
+  ):
+    self.max_pending = max_pending
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.max_retries = max_retries
+
+    self._pending: Dict[Key, List[PendingWrite]] = {}
+    self._in_flight: Dict[Key, asyncio.Future] = {}
+    self._size = 0
+    self._space = asyncio.Condition()
+    self._has_writes = asyncio.Event()
+    self._batch_full = asyncio.Event()
+    self._worker: Optional[asyncio.Task] = None
+    self._closing = False
+
+    self.enqueued = 0
+    self.coalesced = 0
+    self.written = 0
+    self.batches = 0
+    self.waits = 0
+    self.dropped = 0
+    self.failed = 0
+
+  def _add(self, key: Key, write: PendingWrite):
+    self.enqueued += 1
+    writes = self._pending.setdefault(key, [])
+    if writes:
+      combined = combine(writes[-1], write)
+      if combined is not None:
+        writes[-1] = combined
+        self.coalesced += 1
+        return
+    writes.append(write)
+    self._size += 1
+    self._has_writes.set()
+    if self._size >= self.batch_size:
+      self._batch_full.set()
+
+  def _ensure_worker(self):
+    if self._worker is None or self._worker.done():
+      self._worker = asyncio.create_task(self._run())
+
+  async def put(self, key: Hashable, write: PendingWrite):
+    '''
+    Queues a write, waiting for room when the queue is full
+    '''
+    key = (write.collection, key)
+    self._ensure_worker()
+    if self._size >= self.max_pending and key not in self._pending:
+      self.waits += 1
+      async with self._space:
+        await self._space.wait_for(lambda: self._size < self.max_pending)
+    self._add(key, write)
+
+  def offer(self, key: Hashable, write: PendingWrite) -> bool:
+    '''
+    Queues a write unless the queue is full, in which case it is dropped
+    '''
+    key = (write.collection, key)
+    self._ensure_worker()
+    if self._size >= self.max_pending and key not in self._pending:
+      self.dropped += 1
+      return False
+    self._add(key, write)
+    return True
+
+  async def _run(self):
+    while True:
+      await self._has_writes.wait()
+      if not self._closing and self._size < self.batch_size:
+        # Give the batch a chance to fill up
+        try:
+          await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+          pass
+      await self.flush()
+
+  def _take(self, limit: int) -> Dict[Key, PendingWrite]:
+    batch = {}
+    for key in list(self._pending)[:limit]:
+      if key in self._in_flight:
+        # Keep writes to the same document in order
+        continue
+      writes = self._pending[key]
+      batch[key] = writes.pop(0)
+      if not writes:
+        del self._pending[key]
+      self._size -= 1
+
+    if not self._pending:
+      self._has_writes.clear()
+    if self._size < self.batch_size:
+      self._batch_full.clear()
+    return batch
+
+  async def flush(self):
+    batch = self._take(self.batch_size)
+    if not batch:
+      # Everything queued belongs to documents that are being written right now
+      await asyncio.sleep(self.flush_interval)
+      return
+
+    future = asyncio.get_running_loop().create_future()
+    for key in batch:
+      self._in_flight[key] = future
+
+    async with self._space:
+      self._space.notify_all()
+
+    try:
+      await self._execute(batch)
+    finally:
+      for key in batch:
+        if self._in_flight.get(key) is future:
+          del self._in_flight[key]
+      future.set_result(None)
+
+  async def _execute(self, batch: Dict[Key, PendingWrite]):
+    self.batches += 1
+    by_collection: Dict[str, List[Tuple[Key, PendingWrite]]] = {}
+    jobs = []
+    for key, write in batch.items():
+      if write.job:
+        jobs.append((key, write))
+      else:
+        by_collection.setdefault(write.collection, []).append((key, write))
+
+    async def bulk_write(collection: str, writes: List[Tuple[Key, PendingWrite]]):
+      try:
+        await mongo_client.quest[collection].bulk_write([write.operation() for _, write in writes], ordered=False)
+        self.written += len(writes)
+      except BulkWriteError as e:
+        # Per-document errors (e.g. duplicate keys) won't succeed on a retry
+        errors = e.details.get("writeErrors", [])
+        self.failed += len(errors)
+        self.written += len(writes) - len(errors)
+        print(f"{len(errors)} writes to {collection} failed: {errors[:1]}")
+      except Exception as e:
+        print(f"Error writing batch to {collection}: {e}")
+        self._retry(writes)
+
+    async def run_job(key: Key, write: PendingWrite):
+      try:
+        await write.job()
+        self.written += 1
+      except Exception as e:
+        print(f"Error running queued write for {key}: {e}")
+        self._retry([(key, write)])
+
+    await asyncio.gather(
+      *(bulk_write(collection, writes) for collection, writes in by_collection.items()),
+      *(run_job(key, write) for key, write in jobs)
+    )
+
+  def _retry(self, writes: List[Tuple[Key, PendingWrite]]):
+    for key, write in writes:
+      write.attempts += 1
+      if write.attempts > self.max_retries:
+        self.failed += 1
+        print(f"Giving up on write to {key} after {write.attempts} attempts")
+        continue
+
+      queued = self._pending.get(key)
+      if queued:
+        combined = combine(write, queued[0])
+        if combined is not None:
+          queued[0] = combined
+          continue
+        queued.insert(0, write)
+      else:
+        self._pending[key] = [write]
+      self._size += 1
+      self._has_writes.set()
+
+  async def settle(self, collection: str, key: Hashable):
+    '''
+    Writes anything queued for a document now, so it can be read back
+    '''
+    key = (collection, key)
+    while key in self._pending or key in self._in_flight:
+      future = self._in_flight.get(key)
+      if future is not None:
+        await asyncio.shield(future)
+        continue
+      write = self._pending[key].pop(0)
+      if not self._pending[key]:
+        del self._pending[key]
+      self._size -= 1
+      future = asyncio.get_running_loop().create_future()
+      self._in_flight[key] = future
+      try:
+        await self._execute({key: write})
+      finally:
+        if self._in_flight.get(key) is future:
+          del self._in_flight[key]
+        future.set_result(None)
+
+  async def drain(self, timeout: float = WRITE_QUEUE_DRAIN_TIMEOUT):
+    '''
+    Flushes everything queued, for shutdown
+    '''
+    self._closing = True
+    deadline = time.time() + timeout
+    if self._pending:
+      self._ensure_worker()
+      self._has_writes.set()
+      self._batch_full.set()
+
+    while (self._pending or self._in_flight) and time.time() < deadline:
+      await asyncio.sleep(0.05)
+
+    if self._size:
+      print(f"Dropping {self._size} queued writes that could not be flushed before shutdown")
+
+    if self._worker is not None:
+      self._worker.cancel()
+      self._worker = None
+
+  def stats(self) -> dict:
+    return {
+      "pending": self._size,
+      "in_flight": len(self._in_flight),
+      "max_pending": self.max_pending,
+      "enqueued": self.enqueued,
+      "coalesced": self.coalesced,
+      "written": self.written,
+      "batches": self.batches,
+      "backpressure_waits": self.waits,
+      "dropped": self.dropped,
+      "failed": self.failed,
+    }
+
+_queue = WriteBehindQueue()
+
+async def update(collection: str, key: Hashable, filter: dict, update: dict, upsert: bool = False):
+  await _queue.put(key, PendingWrite(collection, filter, update=update, upsert=upsert))
+
+async def replace(collection: str, key: Hashable, filter: dict, replacement: dict, upsert: bool = True):
+  await _queue.put(key, PendingWrite(collection, filter, replacement=replacement, upsert=upsert))
+
+def offer_replace(collection: str, key: Hashable, filter: dict, replacement: dict, upsert: bool = True) -> bool:
+  return _queue.offer(key, PendingWrite(collection, filter, replacement=replacement, upsert=upsert))
+
+async def put_job(collection: str, key: Hashable, job: Callable[[], Awaitable[Any]], owner: Any = None):
+  await _queue.put(key, PendingWrite(collection, job=job, owner=owner))
+
+async def settle(collection: str, key: Hashable):
+  await _queue.settle(collection, key)
+
+def stats() -> dict:
+  return _queue.stats()
+
+async def shutdown():
+  await _queue.drain()